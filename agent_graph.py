@@ -1,76 +1,647 @@
 from strands import Agent
 from strands.tools.mcp import MCPClient
 from strands.multiagent import GraphBuilder
-from strands.multiagent.graph import GraphState
+from strands.models import BedrockModel
+from strands.multiagent.base import Status
+from strands.types.exceptions import MCPClientInitializationError
 from bedrock_agentcore.runtime import BedrockAgentCoreApp
-from typing import Any, Dict
+from bedrock_agentcore.runtime.context import BedrockAgentCoreContext
+from collections import OrderedDict
+from dataclasses import dataclass
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterable
+from weakref import WeakKeyDictionary
+import asyncio
+import atexit
+import base64
+import contextvars
+import hashlib
+import importlib.util
+import io
+import itertools
 import logging
+import operator
 import json
+import time
 from boto3.session import Session
 import os
+import re
 
 # MCPクライアント用のインポート
 from mcp.client.streamable_http import streamablehttp_client
+import httpx
 
 # AgentCore Identityからアクセストークンを取得する
 from bedrock_agentcore.identity.auth import requires_access_token
 
+try:
+    # Strands 1.8以降: 1ターン内の複数tool_useの実行方式を選べる
+    from strands.tools.executors import ConcurrentToolExecutor, SequentialToolExecutor
+except ImportError:
+    ConcurrentToolExecutor = SequentialToolExecutor = None
+
+# HTTP/2（任意依存 h2 があれば有効化。無ければHTTP/1.1のkeep-aliveのみ）
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# 高速なJSONライブラリ（任意依存。無ければ標準ライブラリを使う）
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger("agent_graph")
-logger.setLevel(logging.DEBUG)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
 logging.basicConfig(
     format="%(levelname)s | %(name)s | %(message)s",
     handlers=[logging.StreamHandler()]
 )
 
+# boto3セッションとリージョンは起動時に一度だけ解決し、以降は使い回す
+# （プロファイル等でリージョンが決まらない場合は AWS_REGION → us-east-1）
 _boto_session = Session()
+if _boto_session.region_name is None:
+    _boto_session = Session(region_name=os.environ.get("AWS_REGION", "us-east-1"))
 region = _boto_session.region_name
 
 
+# ===== 設定（プロセス起動時に一度だけ読み込む） =====
+@dataclass(frozen=True)
+class AgentConfig:
+    """環境変数から読み込んだエージェント設定。"""
+    gateway_url: str
+    cognito_scope: str
+    workload_name: str
+    user_id: str
+    region: str | None
+
+
+def _load_config() -> AgentConfig:
+    """環境変数から設定を読み込んで検証する。不備があればValueErrorを送出。"""
+    config = AgentConfig(
+        gateway_url=os.environ.get("GATEWAY_URL", "https://slack-gateway-uzumouvte3.gateway.bedrock-agentcore.us-east-1.amazonaws.com/mcp"),
+        cognito_scope=os.environ.get("COGNITO_SCOPE", "slack-gateway/genesis-gateway:invoke"),
+        workload_name=os.environ.get("WORKLOAD_NAME", "slack-gateway-agent"),
+        user_id=os.environ.get("USER_ID", "m2m-user-001"),
+        region=region,
+    )
+
+    # 環境変数の検証
+    if not config.gateway_url:
+        raise ValueError("GATEWAY_URL環境変数が必要です")
+    if not config.cognito_scope:
+        raise ValueError("COGNITO_SCOPE環境変数が必要です")
+
+    logger.debug("Gateway URL: %s", config.gateway_url)
+    logger.debug("Cognito scope: %s", config.cognito_scope)
+    logger.debug("Workload name: %s", config.workload_name)
+    logger.debug("User ID: %s", config.user_id)
+    logger.debug("AWS Region: %s", config.region)
+    return config
+
+
+# 設定は起動時に一度だけ読み込む。不備があればエラーを保持し、リクエストにはそれを返す
+_INIT_ERROR: Exception | None = None
+try:
+    _CONFIG: AgentConfig | None = _load_config()
+except ValueError as e:
+    logger.error("設定エラー: %s", e)
+    _CONFIG = None
+    _INIT_ERROR = e
+
+# エージェントが使うモデル（ペイロードの model_id で上書き可）
+MODEL_ID = os.environ.get("MODEL_ID", "us.anthropic.claude-sonnet-4-20250514-v1:0")
+# 1ターン内の複数ツール呼び出しの実行方式（concurrent: 並行 / sequential: 逐次）
+# concurrent はStrandsの既定と同じ。同時に実行してはいけないツールがある場合の逃げ道として sequential を選べる
+TOOL_EXECUTOR = os.environ.get("TOOL_EXECUTOR", "concurrent").lower()
+
+# ===== アクセストークンキャッシュ =====
+# (workload_name, user_id, cognito_scope) -> (access_token, expires_at[epoch秒], 認証ヘッダー)
+_TOKEN_CACHE: dict[tuple[str, str, str], tuple[str, float, dict[str, str]]] = {}
+_TOKEN_CACHE_LOCK = asyncio.Lock()
+# 有効期限の何秒前から期限切れとみなすか（安全マージン、環境変数で調整可）
+TOKEN_EXPIRY_BUFFER_SECONDS = int(os.environ.get("TOKEN_EXPIRY_BUFFER_SECONDS", "300"))
+# JWTからexpを取得できない場合の想定有効期間（IdPの設定に合わせて環境変数で調整可）
+DEFAULT_TOKEN_TTL_SECONDS = int(os.environ.get("DEFAULT_TOKEN_TTL_SECONDS", "3600"))
+# キャッシュが期限切れ扱いになる何秒前から、リクエストを契機にバックグラウンド更新するか
+# （利用のない間は更新しない。更新はトークン1つにつき1回）
+TOKEN_REFRESH_LEAD_SECONDS = int(os.environ.get("TOKEN_REFRESH_LEAD_SECONDS", "300"))
+# キャッシュキー -> バックグラウンド更新タスク（1回で終了する）
+_TOKEN_REFRESH_TASKS: dict[tuple[str, str, str], asyncio.Task] = {}
+
+# ===== MCPクライアント共有 =====
+# プール本体（MCPSessionPool）は関数定義の後で生成する
+# セッション内のGateway呼び出しで接続（TCP/TLS）を使い回すためのkeep-alive設定
+_MCP_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, keepalive_expiry=300)
+# 開始済みクライアントを使い続ける最大時間（超えたら次の取得時に張り替える）
+MCP_CLIENT_MAX_AGE_SECONDS = int(os.environ.get("MCP_CLIENT_MAX_AGE_SECONDS", "1800"))
+# 最後の利用からこの秒数以上空いたクライアントは、貸し出し前に疎通確認する
+MCP_CLIENT_HEALTH_CHECK_IDLE_SECONDS = int(os.environ.get("MCP_CLIENT_HEALTH_CHECK_IDLE_SECONDS", "60"))
+MCP_CLIENT_HEALTH_CHECK_TIMEOUT_SECONDS = 10
+# MCPClientがツール呼び出し自体の失敗（通信エラー等）を変換したエラー結果の本文の接頭辞
+_MCP_CALL_FAILURE_PREFIX = "Tool execution failed"
+
+# ===== ツール一覧キャッシュ =====
+# gateway_url -> (取得時刻[monotonic], 取得に使ったMCPClient, ツール一覧, キーワード別のツール一覧)
+# ツールは取得元のMCPClientに紐づくため、クライアントが変わればキャッシュは無効
+_TOOLS_CACHE: dict[str, tuple[float, MCPClient, list, dict[str, list]]] = {}
+_TOOLS_CACHE_LOCK = asyncio.Lock()
+TOOLS_CACHE_TTL_SECONDS = int(os.environ.get("TOOLS_CACHE_TTL_SECONDS", "600"))
+# ツール一覧の取得時に振り分けておくキーワード（小文字）
+# 空文字はすべてのツール名に含まれるため「全ツール」の枠になる
+_ALL_TOOLS = ""
+_TOOL_PARTITION_KEYWORDS = ("slack", "tavily", "extract", _ALL_TOOLS)
+
+# ===== 応答キャッシュ =====
+# sha256(モデルID + 前後の空白を除いたプロンプト) -> (保存時刻[monotonic], 構造化レスポンス)
+# 同じ依頼の繰り返しではGraph（LLM・MCP呼び出し）を丸ごと省略する
+# Slackチャンネルなど刻々と変わる情報を読むため既定では使わず、
+# ペイロードで use_cache を指定したリクエストだけが対象（オプトイン）
+_RESULT_CACHE: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", "300"))
+RESULT_CACHE_MAXSIZE = int(os.environ.get("RESULT_CACHE_MAXSIZE", "512"))
+
+# ===== Bedrockモデルキャッシュ =====
+# モデルID -> BedrockModel
+# model_id はペイロードで上書きできるため、件数を制限して古いものから破棄する
+_BEDROCK_MODELS: OrderedDict[str, BedrockModel] = OrderedDict()
+BEDROCK_MODEL_CACHE_MAXSIZE = int(os.environ.get("BEDROCK_MODEL_CACHE_MAXSIZE", "8"))
+
+# ===== ツール名キャッシュ =====
+# ツールオブジェクト -> 名前（ツールが破棄されれば自動で消える）
+_TOOL_NAME_CACHE: "WeakKeyDictionary[Any, str]" = WeakKeyDictionary()
+# 弱参照できないツール用: id(tool) -> (tool, name)
+_TOOL_NAME_FALLBACK_CACHE: OrderedDict[int, tuple[Any, str]] = OrderedDict()
+TOOL_NAME_FALLBACK_CACHE_MAXSIZE = 1024
+
+
 # ===== ユーティリティ関数（再利用可能・テスト容易化） =====
+if orjson is not None:
+    def _json_loads(data: str | bytes) -> Any:
+        """JSONをデコードする。"""
+        return orjson.loads(data)
+
+    def _json_dumps(obj: Any) -> str:
+        """JSONを（非ASCIIをエスケープせずに）文字列へエンコードする。"""
+        # ツール結果のJSONに数値キーが含まれていても標準jsonと同様に文字列キーとして出力する
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+else:
+    def _json_loads(data: str | bytes) -> Any:
+        """JSONをデコードする。"""
+        return json.loads(data)
+
+    def _json_dumps(obj: Any) -> str:
+        """JSONを（非ASCIIをエスケープせずに）文字列へエンコードする。"""
+        return json.dumps(obj, ensure_ascii=False)
+
+
+def _resolve_tool_name(tool: Any) -> str:
+    """ツール名を tool_name → name → str(tool) の順に解決する（キャッシュなし）。
+
+    getattr のデフォルト引数は先に評価されるため、str(tool) は
+    どちらの属性も無い場合にだけ呼ぶ。
+    """
+    for attr in ("tool_name", "name"):
+        try:
+            return getattr(tool, attr)
+        except AttributeError:
+            pass
+    return str(tool)
+
+
 def _get_tool_name(tool: Any) -> str:
-    """ツール名を頑健に抽出する。"""
-    return getattr(tool, "tool_name", getattr(tool, "name", str(tool)))
+    """ツール名を頑健に抽出する（ツールごとに初回のみ計算してキャッシュ）。"""
+    try:
+        return _TOOL_NAME_CACHE[tool]
+    except KeyError:
+        name = _resolve_tool_name(tool)
+        _TOOL_NAME_CACHE[tool] = name
+        return name
+    except TypeError:
+        # 弱参照/ハッシュ不可のオブジェクトは id キーの上限付きキャッシュへ
+        cached = _TOOL_NAME_FALLBACK_CACHE.get(id(tool))
+        if cached is not None and cached[0] is tool:
+            return cached[1]
+        name = _resolve_tool_name(tool)
+        if len(_TOOL_NAME_FALLBACK_CACHE) >= TOOL_NAME_FALLBACK_CACHE_MAXSIZE:
+            _TOOL_NAME_FALLBACK_CACHE.popitem(last=False)
+        # ツール自体も保持して id の再利用による取り違えを防ぐ
+        _TOOL_NAME_FALLBACK_CACHE[id(tool)] = (tool, name)
+        return name
+
+
+def _get_tool_names(tools: list) -> list[str]:
+    """ツール名の一覧を抽出する（各ツールの名前は _get_tool_name でキャッシュ済み）。"""
+    return [_get_tool_name(t) for t in tools]
+
+
+def _get_bedrock_model(model_id: str) -> BedrockModel:
+    """モデルIDごとのBedrockModelを返す（共有boto3セッションで一度だけ作成）。
 
+    Agent(model="...") に文字列を渡すとAgentごとにBedrockModel（＝boto3クライアント）が
+    作られるため、モデルを使い回してクライアント生成と認証情報の解決を省略する。
+    BedrockModelは会話状態を持たないので、同時実行されるAgent間で共有できる。
+    """
+    model = _BEDROCK_MODELS.get(model_id)
+    if model is None:
+        model = _BEDROCK_MODELS[model_id] = BedrockModel(model_id=model_id, boto_session=_boto_session)
+        while len(_BEDROCK_MODELS) > BEDROCK_MODEL_CACHE_MAXSIZE:
+            _BEDROCK_MODELS.popitem(last=False)
+    else:
+        _BEDROCK_MODELS.move_to_end(model_id)
+    return model
+
+
+def _tool_executor_kwargs() -> dict[str, Any]:
+    """Agent(...) に渡す tool_executor 引数を返す（未対応のStrandsでは空）。
+
+    既定の concurrent はStrandsの既定（ConcurrentToolExecutor）と同じで性能は変わらない。
+    TOOL_EXECUTOR=sequential の場合だけ逐次実行に切り替える。
+    """
+    if ConcurrentToolExecutor is None:
+        return {}
+    if TOOL_EXECUTOR == "sequential":
+        return {"tool_executor": SequentialToolExecutor()}
+    return {"tool_executor": ConcurrentToolExecutor()}
+
+
+def _partition_tools(tools: list) -> dict[str, list]:
+    """ツールを名前に含まれるキーワード（_TOOL_PARTITION_KEYWORDS）ごとに1パスで振り分ける。"""
+    partition: dict[str, list] = {keyword: [] for keyword in _TOOL_PARTITION_KEYWORDS}
+    buckets = tuple((keyword, bucket.append) for keyword, bucket in partition.items())
+    for tool, name in zip(tools, _get_tool_names(tools)):
+        name = name.lower()
+        for keyword, append in buckets:
+            if keyword in name:
+                append(tool)
+    return partition
+
+
+def _is_tools_cache_fresh(cached: tuple | None, client: MCPClient) -> bool:
+    """ツール一覧キャッシュのエントリが同じクライアントから取得され、TTL内かを判定する。"""
+    return (
+        cached is not None
+        and cached[1] is client
+        and time.monotonic() - cached[0] < TOOLS_CACHE_TTL_SECONDS
+    )
+
+
+async def list_all_tools(client: MCPClient) -> list:
+    """
+    list_tools_sync のページネーションをたどって全ツールを取得する（キャッシュなし）。
+
+    MCPのカーソルは前ページのレスポンスでのみ得られる不透明な値で、
+    総件数も返らないため、ページの先読み・並列取得はできず逐次に取得します。
+    各ページの同期呼び出しはワーカースレッドで実行し、待ち時間中も
+    イベントループが他のリクエストを処理できるようにします。
+    """
+    pages: list = []
+    pagination_token = None
+
+    while True:
+        tmp_tools = await asyncio.to_thread(client.list_tools_sync, pagination_token=pagination_token)
+        pages.append(tmp_tools)
+        # 空文字のカーソルを返すサーバーもあるため、偽値はすべて終端として扱う
+        if not getattr(tmp_tools, "pagination_token", None):
+            break
+        pagination_token = tmp_tools.pagination_token
+
+    # ページは最後にまとめて1回だけ平坦化する
+    return list(itertools.chain.from_iterable(pages))
 
-def _filter_tools_by_keyword(tools: list, keyword: str) -> list:
-    """指定キーワードを含むツールのみを抽出する。"""
-    key = keyword.lower()
-    return [t for t in tools if key in _get_tool_name(t).lower()]
+
+def store_tools_cache(gateway_url: str, client: MCPClient, tools: list) -> tuple[float, MCPClient, list, dict[str, list]]:
+    """取得したツール一覧をキャッシュに入れ、そのエントリを返す。"""
+    entry = (time.monotonic(), client, tools, _partition_tools(tools))
+    _TOOLS_CACHE[gateway_url] = entry
+    return entry
+
+
+def _append_text(value: Any, texts_append, jsons_append) -> None:
+    texts_append(value)
+
+
+def _append_json(value: Any, texts_append, jsons_append) -> None:
+    jsons_append(value)
+
+
+def _recurse_tool_result(value: Any, texts_append, jsons_append) -> None:
+    """toolResult内のcontentを処理（ネストしたtoolResultは辿らない）。"""
+    if not value:
+        return
+    for inner in value.get("content", ()):
+        if isinstance(inner, dict):
+            for key in inner.keys() & _INNER_BLOCK_HANDLERS.keys():
+                _INNER_BLOCK_HANDLERS[key](inner[key], texts_append, jsons_append)
+
+
+# コンテンツブロックのキー -> 処理関数（ブロックは通常1キーのみのunion型）
+_INNER_BLOCK_HANDLERS = {"text": _append_text, "json": _append_json}
+_BLOCK_HANDLERS = {**_INNER_BLOCK_HANDLERS, "toolResult": _recurse_tool_result}
 
 
 def extract_message_content(agent_result: Any) -> tuple[str, list]:
     """AgentResultからメッセージコンテンツを抽出（テキスト/JSON）。"""
     try:
-        message = getattr(agent_result, "message", {}) or {}
-        content = message.get("content", [])
+        message = getattr(agent_result, "message", None) or {}
         texts: list[str] = []
         jsons: list = []
+        # ループ内の属性参照を避けるためローカルに束縛
+        texts_append = texts.append
+        jsons_append = jsons.append
+        handlers = _BLOCK_HANDLERS
+        handler_keys = handlers.keys()
 
-        for block in content:
-            if isinstance(block, dict):
-                if "text" in block:
-                    texts.append(block["text"])
-                if "json" in block:
-                    jsons.append(block["json"])
-                # toolResultの中も再帰的に処理
-                if "toolResult" in block:
-                    for inner in block.get("toolResult", {}).get("content", []):
-                        if isinstance(inner, dict):
-                            if "text" in inner:
-                                texts.append(inner["text"])
-                            if "json" in inner:
-                                jsons.append(inner["json"])
+        for block in message.get("content", ()):
+            if not isinstance(block, dict):
+                continue
+            # キーの積集合で該当ハンドラだけを呼ぶ
+            for key in block.keys() & handler_keys:
+                handlers[key](block[key], texts_append, jsons_append)
 
         return "\n".join(texts).strip(), jsons
-    except Exception as e:
-        logger.error(f"メッセージ抽出エラー: {e}")
+    except (AttributeError, KeyError, TypeError) as e:
+        # 想定外の形のメッセージ（dict以外のcontent等）
+        logger.error("メッセージ抽出エラー: %s", e)
         return "", []
 
 
+def _decode_jwt_exp(token: str) -> float | None:
+    """JWTのペイロードから exp クレーム（epoch秒）を取り出す。取得できなければNone。"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = _json_loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp is not None else None
+    except (IndexError, ValueError, TypeError, AttributeError):
+        # JWTでない・base64/JSONとして不正・exp が数値でない（binascii.Error/JSONDecodeErrorはValueError）
+        return None
+
+
+def _make_token_entry(access_token: str) -> tuple[str, float, dict[str, str]]:
+    """トークンキャッシュのエントリ（有効期限・Authorizationヘッダー付き）を作る。"""
+    expires_at = _decode_jwt_exp(access_token) or time.time() + DEFAULT_TOKEN_TTL_SECONDS
+    return access_token, expires_at, {"Authorization": f"Bearer {access_token}"}
+
+
+def _stop_mcp_client(client: MCPClient) -> None:
+    """開始済みのMCPClientを停止する（停止時の例外はログのみ）。"""
+    try:
+        client.stop(None, None, None)
+    except Exception as e:
+        logger.warning("MCPクライアント停止時にエラー: %s", e)
+
+
+def invalidate_tools_cache(gateway_url: str | None = None) -> None:
+    """ツール一覧キャッシュを破棄する（gateway_url省略時は全件）。"""
+    if gateway_url is None:
+        _TOOLS_CACHE.clear()
+    else:
+        _TOOLS_CACHE.pop(gateway_url, None)
+
+
+@dataclass
+class _PooledMCPClient:
+    """プールが管理する開始済みMCPClientと貸し出し状況。"""
+    client: MCPClient
+    gateway_url: str
+    access_token: str
+    started_at: float
+    last_used: float
+    leases: int = 0
+    retired: bool = False
+
+
+class MCPSessionPool:
+    """
+    gateway_urlごとに開始済みのMCPClientを1つ保持し、リクエストをまたいで貸し出すプール。
+
+    - acquire() で開始済みクライアントを借り、使い終わったら release() で返す
+      （通常は ``async with pool.session(...)`` を使う）
+    - トークン更新・最大利用時間（MCP_CLIENT_MAX_AGE_SECONDS）超過・疎通確認の失敗・
+      discard() で新しいクライアントへ張り替える。旧クライアントは
+      貸し出し中のリクエストがすべて返却した時点で停止する
+    - しばらく使われていなかったクライアント（MCP_CLIENT_HEALTH_CHECK_IDLE_SECONDS）は
+      貸し出し時にロックの外でツール一覧を取得して疎通を確認する
+      （取得結果はツール一覧キャッシュに入れ、直後の再取得を省く）
+    - start()/stop() はバックグラウンドスレッドのセッション初期化・終了を同期的に待つため、
+      イベントループを塞がないようワーカースレッドで実行する
+    """
+
+    def __init__(
+        self,
+        max_age_seconds: float = MCP_CLIENT_MAX_AGE_SECONDS,
+        health_check_idle_seconds: float = MCP_CLIENT_HEALTH_CHECK_IDLE_SECONDS,
+    ):
+        self._max_age_seconds = max_age_seconds
+        self._health_check_idle_seconds = health_check_idle_seconds
+        self._lock = asyncio.Lock()
+        # gateway_url -> 現在貸し出し対象のクライアント
+        self._active: dict[str, _PooledMCPClient] = {}
+        # id(MCPClient) -> エントリ（張り替え済みで返却待ちのものも含む）
+        self._entries: dict[int, _PooledMCPClient] = {}
+
+    async def acquire(
+        self,
+        gateway_url: str,
+        access_token: str,
+        client_factory: Callable[[], Awaitable[MCPClient]],
+    ) -> MCPClient:
+        """開始済みのMCPClientを借りる（必要なら client_factory で作成して開始する）。"""
+        async with self._lock:
+            entry = self._active.get(gateway_url)
+            now = time.monotonic()
+            if entry and (
+                entry.access_token != access_token
+                or now - entry.started_at >= self._max_age_seconds
+            ):
+                logger.info("🔄 トークン更新または利用時間超過のためMCPクライアントを張り替えます")
+                await self._retire(gateway_url)
+                entry = None
+
+            # 疎通確認はロックの外で行う（他のリクエスト・他のGatewayを待たせない）
+            needs_check = (
+                entry is not None
+                and entry.leases == 0
+                and now - entry.last_used >= self._health_check_idle_seconds
+            )
+
+            if entry is None:
+                mcp_client = await client_factory()
+                await asyncio.to_thread(mcp_client.start)
+                now = time.monotonic()
+                entry = _PooledMCPClient(mcp_client, gateway_url, access_token, now, now)
+                self._active[gateway_url] = entry
+                self._entries[id(mcp_client)] = entry
+
+            entry.leases += 1
+            entry.last_used = now
+
+        # 貸し出し済み（leases > 0）なので確認中に停止されることはない
+        if needs_check and not await self._is_alive(entry):
+            logger.warning("⚠️ 疎通確認に失敗したためMCPクライアントを張り替えます")
+            await self.release(entry.client, discard=True)
+            # 張り替え後のクライアントは作成直後のため再び疎通確認されることはない
+            return await self.acquire(gateway_url, access_token, client_factory)
+        return entry.client
+
+    async def release(self, client: MCPClient, discard: bool = False) -> None:
+        """借りたクライアントを返す。discard=True の場合は以後貸し出さない。"""
+        async with self._lock:
+            entry = self._entries.get(id(client))
+            if entry is None or entry.client is not client:
+                return
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+            if discard:
+                self._detach(entry)
+            if entry.retired and entry.leases <= 0:
+                await self._stop(entry)
+
+    async def discard(self, client: MCPClient) -> None:
+        """借用中のクライアントを以後貸し出さないようにする（返却は別途 release で行う）。
+
+        Strandsのツール呼び出しは通信エラーを例外ではなくエラー結果として返すため、
+        Graphの実行後にエラーを見つけた場合など、例外が外に出ない経路で使う。
+        """
+        async with self._lock:
+            entry = self._entries.get(id(client))
+            if entry is not None and entry.client is client:
+                self._detach(entry)
+
+    @asynccontextmanager
+    async def session(
+        self,
+        gateway_url: str,
+        access_token: str,
+        client_factory: Callable[[], Awaitable[MCPClient]],
+    ):
+        """acquire/release を対にするコンテキストマネージャ。
+
+        ブロック内から例外が送出された場合、そのクライアントは以後貸し出さない。
+        """
+        client = await self.acquire(gateway_url, access_token, client_factory)
+        discard = False
+        try:
+            yield client
+        except Exception:
+            discard = True
+            raise
+        finally:
+            await self.release(client, discard=discard)
+
+    async def _retire(self, gateway_url: str) -> None:
+        """現在のクライアントを貸し出し対象から外す（ロック取得済みで呼ぶこと）。"""
+        entry = self._active.get(gateway_url)
+        if entry is None:
+            invalidate_tools_cache(gateway_url)
+            return
+        self._detach(entry)
+        if entry.leases <= 0:
+            await self._stop(entry)
+
+    def _detach(self, entry: _PooledMCPClient) -> None:
+        """エントリを貸し出し対象から外す（停止は返却を待つ。ロック取得済みで呼ぶこと）。"""
+        if entry.retired:
+            return
+        entry.retired = True
+        if self._active.get(entry.gateway_url) is entry:
+            del self._active[entry.gateway_url]
+            # ツールは取得元のクライアントに紐づくため一緒に破棄する
+            invalidate_tools_cache(entry.gateway_url)
+
+    async def _is_alive(self, entry: _PooledMCPClient) -> bool:
+        """ツール一覧を取得できるかでセッションの疎通を確認する。
+
+        取得したツール一覧はツール一覧キャッシュに入れ、直後のリクエストでの再取得を省く。
+        """
+        try:
+            tools = await asyncio.wait_for(
+                list_all_tools(entry.client),
+                MCP_CLIENT_HEALTH_CHECK_TIMEOUT_SECONDS,
+            )
+        except Exception as e:  # asyncio.TimeoutError を含む
+            logger.warning("MCPクライアントの疎通確認に失敗: %s", e)
+            return False
+        store_tools_cache(entry.gateway_url, entry.client, tools)
+        return True
+
+    async def _stop(self, entry: _PooledMCPClient) -> None:
+        self._entries.pop(id(entry.client), None)
+        await asyncio.to_thread(_stop_mcp_client, entry.client)
+
+    def close_all(self) -> None:
+        """すべてのクライアントを停止する（プロセス終了時用・同期）。"""
+        entries = list(self._entries.values())
+        self._active.clear()
+        self._entries.clear()
+        for entry in entries:
+            _stop_mcp_client(entry.client)
+
+
+_MCP_POOL = MCPSessionPool()
+
+
+@atexit.register
+def close_mcp_clients() -> None:
+    """プロセス終了時に共有MCPクライアントをすべて停止する。"""
+    _MCP_POOL.close_all()
+
+
+def _create_mcp_http_client(
+    headers: dict[str, str] | None = None,
+    timeout: httpx.Timeout | None = None,
+    auth: httpx.Auth | None = None,
+) -> httpx.AsyncClient:
+    """
+    MCPトランスポート用のhttpxクライアントを作る（streamablehttp_client の httpx_client_factory）。
+
+    mcp 標準のファクトリと同じ既定値に、HTTP/2 とkeep-aliveの接続上限を加えたもの。
+    クライアントはMCPClientのバックグラウンドのイベントループ上でセッションと同じ寿命で
+    使われ、セッション終了時に閉じられるため、プロセス全体での共有はせず
+    プールされたセッション（MCPSessionPool）ごとに1つ作る。
+    """
+    kwargs: dict[str, Any] = {
+        "follow_redirects": True,
+        "http2": _HTTP2_AVAILABLE,
+        "limits": _MCP_HTTP_LIMITS,
+        "timeout": timeout if timeout is not None else httpx.Timeout(30.0, read=300.0),
+    }
+    if headers is not None:
+        kwargs["headers"] = headers
+    if auth is not None:
+        kwargs["auth"] = auth
+    return httpx.AsyncClient(**kwargs)
+
+
+# MCPツール使用の目印となるキーワード（小文字）
+_MCP_INDICATORS = ("slack_", "tavily_", "extract", "search")
+# 全キーワードを1回の走査で探す（小文字化したコピーを作らない）
+_MCP_RE = re.compile("|".join(map(re.escape, _MCP_INDICATORS)), re.IGNORECASE)
+
+
 def detect_mcp_usage(text: str) -> bool:
     """MCPツールが使用されたかを簡易検出。"""
-    mcp_indicators = ["slack_", "tavily_", "extract", "search"]
-    return any(indicator in text.lower() for indicator in mcp_indicators)
+    return _MCP_RE.search(text) is not None
+
+
+def tool_error_results(agents: Iterable[Agent]) -> list[dict]:
+    """エージェントの会話履歴から status が error のツール結果を集める。"""
+    errors = []
+    for agent in agents:
+        for message in getattr(agent, "messages", None) or ():
+            for block in message.get("content", ()):
+                tool_result = block.get("toolResult") if isinstance(block, dict) else None
+                if tool_result and tool_result.get("status") == "error":
+                    errors.append(tool_result)
+    return errors
+
+
+def is_mcp_call_failure(tool_result: dict) -> bool:
+    """MCPClientが呼び出し自体の失敗（通信エラー等）を変換したエラー結果かを判定。"""
+    return any(
+        isinstance(content, dict) and str(content.get("text", "")).startswith(_MCP_CALL_FAILURE_PREFIX)
+        for content in tool_result.get("content", ())
+    )
 
 
 def parse_prompt_from_payload(payload: Dict[str, Any]) -> str:
@@ -78,65 +649,172 @@ def parse_prompt_from_payload(payload: Dict[str, Any]) -> str:
     if not payload:
         return ""
     # 入れ子構造（input フィールド）に対応
-    if "input" in payload:
-        input_data = payload["input"]
-        if isinstance(input_data, dict):
-            return input_data.get("prompt", "")
-        if isinstance(input_data, str):
-            try:
-                return json.loads(input_data).get("prompt", "")
-            except Exception:
-                return input_data
+    input_data = payload.get("input")
+    if isinstance(input_data, dict):
+        return input_data.get("prompt", "")
+    if isinstance(input_data, str):
+        try:
+            parsed = _json_loads(input_data)
+        except json.JSONDecodeError:  # orjson.JSONDecodeError もこのサブクラス
+            return input_data
+        return parsed.get("prompt", "") if isinstance(parsed, dict) else input_data
     # 直接 prompt があるケース
-    if "prompt" in payload:
-        return str(payload["prompt"])  # 念のため文字列化
+    if (prompt := payload.get("prompt")) is not None:
+        return str(prompt)  # 念のため文字列化
     return ""
 
 
-def always_false_condition(_: GraphState) -> bool:
-    """常にFalseを返す条件（終了ポイントとして機能）。"""
-    logger.info("🔚 終了条件を評価 - 常にFalseを返してグラフを終了")
-    return False
+def _get_payload_option(payload: Dict[str, Any], key: str) -> Any:
+    """ペイロードの任意オプションを取得する（input 内の指定を優先）。"""
+    if not payload:
+        return None
+    input_data = payload.get("input")
+    if isinstance(input_data, dict) and key in input_data:
+        return input_data[key]
+    return payload.get(key)
+
+
+def parse_model_id_from_payload(payload: Dict[str, Any]) -> str:
+    """ペイロードからモデルIDの上書き指定（model_id）を抽出する。無ければ空文字。"""
+    return str(_get_payload_option(payload, "model_id") or "")
+
+
+def _result_cache_key(user_message: str, model_id: str) -> str:
+    """応答キャッシュのキー（モデルIDと前後の空白を除いたプロンプトのハッシュ）を作る。
+
+    チャンネル名・URL・IDは大文字小文字を区別するため、プロンプトの大文字小文字は区別する。
+    """
+    normalized = f"{model_id}\n{user_message.strip()}"
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _get_cached_result(key: str) -> dict | None:
+    """有効期限内の応答キャッシュを返す。期限切れなら破棄してNone。"""
+    cached = _RESULT_CACHE.get(key)
+    if cached is None:
+        return None
+    if time.monotonic() - cached[0] >= RESULT_CACHE_TTL_SECONDS:
+        del _RESULT_CACHE[key]
+        return None
+    _RESULT_CACHE.move_to_end(key)
+    return cached[1]
+
+
+def _store_cached_result(key: str, structured_response: dict) -> None:
+    """応答をキャッシュする（上限を超えたら古いものから破棄）。"""
+    _RESULT_CACHE[key] = (time.monotonic(), structured_response)
+    _RESULT_CACHE.move_to_end(key)
+    while len(_RESULT_CACHE) > RESULT_CACHE_MAXSIZE:
+        _RESULT_CACHE.popitem(last=False)
+
 
 class ResearchAgent:
     """
     Cognito M2M認証を使用したAgentCore Identityを利用するエージェント。
     
-    必要な環境変数：
+    必要な環境変数（起動時に _load_config() で一度だけ読み込む）：
     - GATEWAY_URL: Slackツールを提供するGatewayのエンドポイント
     - COGNITO_SCOPE: Cognito OAuth2のスコープ
     - WORKLOAD_NAME: （オプション）workload名、デフォルトは"slack-gateway-agent"
     - USER_ID: (オプション)user-idを設定する、デフォルトは"m2m-user-001"
     """
 
-    def __init__(self):
-        self.gateway_url = os.environ.get("GATEWAY_URL", "https://slack-gateway-uzumouvte3.gateway.bedrock-agentcore.us-east-1.amazonaws.com/mcp")
-        self.cognito_scope = os.environ.get("COGNITO_SCOPE", "slack-gateway/genesis-gateway:invoke")
-        self.workload_name = os.environ.get("WORKLOAD_NAME", "slack-gateway-agent")
-        self.user_id = os.environ.get("USER_ID", "m2m-user-001")
-        self.region = region
-        
-        # 環境変数の検証
-        if not self.gateway_url:
-            raise ValueError("GATEWAY_URL環境変数が必要です")
-        if not self.cognito_scope:
-            raise ValueError("COGNITO_SCOPE環境変数が必要です")
-            
-        logger.info(f"Gateway URL: {self.gateway_url}")
-        logger.info(f"Cognito scope: {self.cognito_scope}")
-        logger.info(f"Workload name: {self.workload_name}")
-        logger.info(f"User ID: {self.user_id}")
-        logger.info(f"AWS Region: {self.region}")
+    def __init__(self, config: AgentConfig | None = None):
+        config = config or _CONFIG
+        self.gateway_url = config.gateway_url
+        self.cognito_scope = config.cognito_scope
+        self.workload_name = config.workload_name
+        self.user_id = config.user_id
+        self.region = config.region
 
     async def get_access_token(self) -> str:
         """AgentCore Identityを使用してアクセストークンを取得する。
         
         Runtime環境では、runtimeUserIdはInvokeAgentRuntime API呼び出し時に
         システム側が設定し、Runtimeがエージェントに渡します。
+
+        取得したトークンはプロセス内でキャッシュし、有効期限（exp）の
+        TOKEN_EXPIRY_BUFFER_SECONDS 秒前までは再利用します。期限が近づいてから
+        リクエストがあると、そのリクエストを契機にバックグラウンドで一度だけ
+        先回りして更新するため、利用が続いている間は通常キャッシュの読み取りだけで
+        完了します（利用が途切れて期限切れ扱いになった場合はここで取得）。
         
         Returns:
             str: 認証されたAPIコール用のアクセストークン
         """
+        return (await self._get_token_entry())[0]
+
+    async def get_auth_headers(self) -> dict[str, str]:
+        """キャッシュ済みトークンに対応する Authorization ヘッダーを返す。
+
+        ヘッダー辞書はトークン取得時に一度だけ作成され、トークンが更新されると
+        新しい辞書に丸ごと差し替わります（呼び出し側で変更しないこと）。
+        """
+        return (await self._get_token_entry())[2]
+
+    async def _get_token_entry(self) -> tuple[str, float, dict[str, str]]:
+        """有効なトークンキャッシュのエントリを返す（必要なら取得する）。"""
+        key = (self.workload_name, self.user_id, self.cognito_scope)
+
+        # 高速パス: ロックを取らずにキャッシュを参照
+        cached = _TOKEN_CACHE.get(key)
+        if cached:
+            remaining = cached[1] - time.time() - TOKEN_EXPIRY_BUFFER_SECONDS
+            if remaining > 0:
+                if remaining <= TOKEN_REFRESH_LEAD_SECONDS:
+                    # 期限切れ扱いが近いので、このリクエストを契機に先回りして更新する
+                    self._schedule_token_refresh(key)
+                return cached
+
+        async with _TOKEN_CACHE_LOCK:
+            # ロック待ちの間に他のリクエストが更新している可能性がある
+            cached = _TOKEN_CACHE.get(key)
+            if cached and cached[1] - time.time() > TOKEN_EXPIRY_BUFFER_SECONDS:
+                return cached
+
+            entry = _make_token_entry(await self._fetch_access_token())
+            _TOKEN_CACHE[key] = entry
+
+        return entry
+
+    def invalidate_access_token(self) -> None:
+        """キャッシュ済みトークンを破棄し、次回取得時に取り直させる。"""
+        _TOKEN_CACHE.pop((self.workload_name, self.user_id, self.cognito_scope), None)
+
+    def _schedule_token_refresh(self, key: tuple[str, str, str]) -> None:
+        """トークン更新タスクが動いていなければ起動する。
+
+        タスクは呼び出し元リクエストのコンテキストを引き継がず、新しいコンテキストで動かす。
+        requires_access_token が参照する workload access token だけは、
+        いま処理中のリクエストで発行されたもの（＝有効なもの）を明示的に渡す。
+        """
+        task = _TOKEN_REFRESH_TASKS.get(key)
+        if task and not task.done():
+            return
+        context = contextvars.Context()
+        context.run(
+            BedrockAgentCoreContext.set_workload_access_token,
+            BedrockAgentCoreContext.get_workload_access_token(),
+        )
+        _TOKEN_REFRESH_TASKS[key] = context.run(asyncio.create_task, self._refresh_token(key))
+
+    async def _refresh_token(self, key: tuple[str, str, str]) -> None:
+        """トークンを一度だけ取り直してキャッシュを差し替える。
+
+        更新に失敗した場合は何もせず、期限切れ扱いになった後のリクエストのインライン取得に任せます。
+        """
+        try:
+            access_token = await self._fetch_access_token()
+        except Exception as e:
+            logger.warning("⚠️ バックグラウンドでのトークン更新に失敗: %s", e)
+            return
+        entry = _make_token_entry(access_token)
+        async with _TOKEN_CACHE_LOCK:
+            _TOKEN_CACHE[key] = entry
+        logger.info("🔄 アクセストークンをバックグラウンドで更新しました")
+
+    async def _fetch_access_token(self) -> str:
+        """AgentCore Identity経由で新しいアクセストークンを取得する（キャッシュなし）。"""
         
         # @requires_access_tokenデコレータ付きのラッパー関数を作成
         # Runtime環境では、デコレータが内部で_get_workload_access_tokenを呼び出し、
@@ -165,9 +843,12 @@ class ResearchAgent:
                 str: APIコールで使用するアクセストークン
             """
             logger.info("✅ AgentCore Identity経由でアクセストークンの取得に成功")
-            logger.info(f"   Workload name: {self.workload_name}")
-            logger.info(f"   トークンプレフィックス: {access_token[:20]}...")
-            logger.info(f"   トークン長: {len(access_token)} 文字")
+            if logger.isEnabledFor(logging.DEBUG):
+                # トークンの先頭・長さはここ（取得直後）で一度だけ記録する
+                logger.debug(
+                    "   Workload name: %s | トークンプレフィックス: %s... | トークン長: %d 文字",
+                    self.workload_name, access_token[:20], len(access_token),
+                )
             return access_token
         
         # デコレータ付き関数を呼び出してトークンを取得
@@ -185,13 +866,13 @@ class ResearchAgent:
         """
 
         # ステップ1: AgentCore Identityを使用してアクセストークンを取得
-        logger.info("ステップ1: AgentCore Identity経由でアクセストークンを取得中...")
-        logger.info(f"Runtimeが自動的にruntimeUserIdを渡します")
+        logger.debug("ステップ1: AgentCore Identity経由でアクセストークンを取得中...")
+        logger.debug("Runtimeが自動的にruntimeUserIdを渡します")
         
-        access_token = await self.get_access_token()
+        auth_headers = await self.get_auth_headers()
         
         # ステップ2: 認証されたMCPクライアントを作成
-        logger.info("ステップ2: 認証されたMCPクライアントを作成中...")
+        logger.debug("ステップ2: 認証されたMCPクライアントを作成中...")
 
         def create_streamable_http_transport():
             """
@@ -200,26 +881,53 @@ class ResearchAgent:
             このトランスポートは、MCPクライアントがGatewayへの認証された
             リクエストを行うために使用されます。
             """
-            logger.info(f"🔗 MCP transport作成中: {self.gateway_url}")
-            logger.info(f"🔑 トークンプレフィックス: {access_token[:20]}...")
+            logger.debug("🔗 MCP transport作成中: %s", self.gateway_url)
             transport = streamablehttp_client(
-                self.gateway_url, 
-                headers={"Authorization": f"Bearer {access_token}"}
+                self.gateway_url,
+                headers=auth_headers,
+                httpx_client_factory=_create_mcp_http_client,
             )
-            logger.info("✅ MCP transport作成完了")
+            logger.debug("✅ MCP transport作成完了")
             return transport
         
         # 認証されたトランスポートでMCPクライアントを作成
         mcp_client = MCPClient(create_streamable_http_transport)
         
         return mcp_client
+
+    @asynccontextmanager
+    async def mcp_session(self):
+        """
+        プロセス内で共有する開始済みMCPクライアントを借りるコンテキストマネージャ。
+
+        gateway_urlごとに1つのセッションを MCPSessionPool で保持し、リクエストをまたいで
+        再利用します。アクセストークンが更新された場合は新しいクライアントへ張り替えます。
+
+        mcp の ClientSession を直接使わず Strands の MCPClient を保持しているのは、
+        Agent(tools=...) に渡すツール（MCPAgentTool）が MCPClient 経由で
+        ツールを実行するためです。MCPClient は専用スレッドのイベントループ上で
+        非同期セッションを動かしており、セッションの寿命はプールで管理します。
+
+        使い方::
+
+            async with agent.mcp_session() as mcp_client:
+                ...
+        """
+        access_token = await self.get_access_token()
+        async with _MCP_POOL.session(
+            self.gateway_url, access_token, self.create_mcp_client_and_tools
+        ) as mcp_client:
+            yield mcp_client
     
-    def get_full_tools_list(self, client: MCPClient) -> list:
+    async def get_full_tools_list(self, client: MCPClient) -> list:
         """
         ページネーションをサポートしてすべての利用可能なツールをリスト。
         
         Gatewayはページネーションされたレスポンスでツールを返す可能性があるため、
         完全なリストを取得するためにページネーションを処理する必要があります。
+
+        取得結果は gateway_url ごとに TOOLS_CACHE_TTL_SECONDS 秒キャッシュし、
+        同じクライアントからの再取得ではページネーションを省略します。
         
         Args:
             client: MCPクライアントインスタンス
@@ -227,119 +935,229 @@ class ResearchAgent:
         Returns:
             list: 利用可能なツールの完全なリスト
         """
-        tools: list = []
-        pagination_token = None
+        return (await self._get_tools_cache_entry(client))[2]
+
+    async def get_tool_partition(self, client: MCPClient) -> dict[str, list]:
+        """
+        キーワード（_TOOL_PARTITION_KEYWORDS）ごとのツール一覧を返す。
+
+        振り分けはツール一覧の取得時に一度だけ行い、キャッシュと一緒に保持します。
+        全ツールは _ALL_TOOLS キーで参照できます。
+        """
+        return (await self._get_tools_cache_entry(client))[3]
 
-        while True:
-            tmp_tools = client.list_tools_sync(pagination_token=pagination_token)
-            tools.extend(tmp_tools)
-            if getattr(tmp_tools, "pagination_token", None) is None:
-                break
-            pagination_token = tmp_tools.pagination_token
+    async def _get_tools_cache_entry(self, client: MCPClient) -> tuple[float, MCPClient, list, dict[str, list]]:
+        """有効なツール一覧キャッシュのエントリを返す（必要ならページネーションして取得）。"""
+        # 高速パス: ロックを取らずにキャッシュを参照（他リクエストの取得完了を待たない）
+        cached = _TOOLS_CACHE.get(self.gateway_url)
+        if _is_tools_cache_fresh(cached, client):
+            return cached
 
-        return tools
+        async with _TOOLS_CACHE_LOCK:
+            # ロック待ちの間に他のリクエストが取得している可能性がある
+            cached = _TOOLS_CACHE.get(self.gateway_url)
+            if _is_tools_cache_fresh(cached, client):
+                return cached
+
+            return store_tools_cache(self.gateway_url, client, await list_all_tools(client))
 
 # ==== Slack Agent Factory ======================================================
 class SlackAgentFactory(ResearchAgent):
     """
     Slack向けAgentのビルダー。
-    - MCPセッションの 'with mcp_client:' は呼び出し側で保持する（重要）
-    - build(...) は *必ず with の中* で呼ぶこと（ツール列挙もその場のセッションで実施）
+    - MCPセッションは呼び出し側で保持する（ResearchAgent.mcp_session() で借りた共有クライアント）
+    - build(...) には *必ず開始済みのクライアント* を渡すこと（ツール列挙もそのセッションで実施）
     """
 
     def __init__(self, model_id: str | None = None, system_prompt: str | None = None):
         super().__init__()
-        self.model_id = model_id or os.environ.get(
-            "MODEL_ID",
-            "us.anthropic.claude-sonnet-4-20250514-v1:0"
-        )
+        self.model_id = model_id or MODEL_ID
         self.system_prompt = system_prompt or (
             "あなたはSlack統合アシスタントです。"
             "指定チャンネルからURLが添付されているメッセージを取得し、"
             "JSONで {urls:[...], evidence:[...]} を返してください。"
         )
 
-    def build(self, mcp_client: MCPClient) -> Agent:
+    async def build(self, mcp_client: MCPClient, tool_partition: dict[str, list] | None = None) -> Agent:
         """
-        with mcp_client: の内側で呼び出すこと。
+        開始済みのMCPクライアントを渡して呼び出すこと。
         MCPツールを列挙し、Slack系のみを選り分けて Agent を生成して返す。
+        tool_partition（get_tool_partition の結果）を渡した場合はツール列挙を省略する。
         """
-        # 1) 現在のセッションでツール列挙（← これが with の内側必須）
-        tools = self.get_full_tools_list(mcp_client)
+        # 1) 現在のセッションでツール列挙（← 開始済みクライアント必須）
+        if tool_partition is None:
+            tool_partition = await self.get_tool_partition(mcp_client)
 
         # 2) Slack系ツールに絞る（無ければ全部使う）
-        slack_tools = _filter_tools_by_keyword(tools, "slack")
+        slack_tools = tool_partition["slack"]
         if not slack_tools:
             logger.warning("Slack系ツールが見つからないため、全ツールを使用します。")
-            slack_tools = tools
+            slack_tools = tool_partition[_ALL_TOOLS]
 
         # 3) Agent生成
         agent = Agent(
             name="SlackAgent",
             tools=slack_tools,
-            model=self.model_id,
+            model=_get_bedrock_model(self.model_id),
             system_prompt=self.system_prompt,
+            **_tool_executor_kwargs(),
         )
 
         # ログ（任意）
-        try:
-            tool_names = [_get_tool_name(t) for t in slack_tools]
-        except Exception:
-            tool_names = [str(t) for t in slack_tools]
-        logger.info(f"SlackAgent 構築: ツール数={len(slack_tools)} -> {tool_names}")
+        logger.info("SlackAgent 構築: ツール数=%d", len(slack_tools))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("SlackAgent ツール: %s", _get_tool_names(slack_tools))
 
         return agent
 
 class TavilyAgentFactory(ResearchAgent):
     """
     Tavily向けAgentのビルダー。
-    - 呼び出し側で with mcp_client: を保持すること（重要）
-    - build(...) は必ず with の中で呼ぶ
+    - 呼び出し側でMCPセッションを保持すること（ResearchAgent.mcp_session() で借りた共有クライアント）
+    - build(...) には必ず開始済みのクライアントを渡す
     """
 
     def __init__(self, model_id: str | None = None, system_prompt: str | None = None):
         super().__init__()
-        self.model_id = model_id or os.environ.get(
-            "MODEL_ID", "us.anthropic.claude-sonnet-4-20250514-v1:0"
-        )
+        self.model_id = model_id or MODEL_ID
         self.system_prompt = system_prompt or (
             "あなたはWeb要約エージェントです。与えられたURLの本文を抽出・要約し、"
             "JSON {summaries:[{url, bullets:[...]}]} を返してください。"
         )
 
-    def build(self, mcp_client: MCPClient) -> Agent:
-        # 1) 現在のセッションでツール列挙（← with の内側必須）
-        tools = self.get_full_tools_list(mcp_client)
+    async def build(self, mcp_client: MCPClient, tool_partition: dict[str, list] | None = None) -> Agent:
+        # 1) 現在のセッションでツール列挙（← 開始済みクライアント必須）
+        #    振り分け済みの tool_partition（get_tool_partition の結果）が渡された場合はそれを使う
+        if tool_partition is None:
+            tool_partition = await self.get_tool_partition(mcp_client)
 
         # 2) Tavily系ツールに絞る（無ければ全部使う）
         #    必要に応じて "extract" や "crawler" なども含めてOK
-        tavily_tools = _filter_tools_by_keyword(tools, "tavily")
-        if not tavily_tools:
-            tavily_tools = _filter_tools_by_keyword(tools, "extract")
+        tavily_tools = tool_partition["tavily"] or tool_partition["extract"]
         if not tavily_tools:
             logger.warning("Tavily系ツールが見つからないため、全ツールを使用します。")
-            tavily_tools = tools
+            tavily_tools = tool_partition[_ALL_TOOLS]
 
         # 3) Agent 生成
         agent = Agent(
             name="TavilyAgent",
             tools=tavily_tools,
-            model=self.model_id,
+            model=_get_bedrock_model(self.model_id),
             system_prompt=self.system_prompt,
+            **_tool_executor_kwargs(),
         )
-        try:
-            names = [_get_tool_name(t) for t in tavily_tools]
-        except Exception:
-            names = [str(t) for t in tavily_tools]
-        logger.info(f"TavilyAgent 構築: ツール数={len(tavily_tools)} -> {names}")
+        logger.info("TavilyAgent 構築: ツール数=%d", len(tavily_tools))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("TavilyAgent ツール: %s", _get_tool_names(tavily_tools))
         return agent
 
-    async def stream(self, agent: Agent, prompt: str):
-        """with mcp_client: の内側で呼ぶこと。"""
-        async for ev in agent.stream_async(prompt):
-            if ev is not None:
-                yield ev
 
+# GraphResult から構造化レスポンスへ写す数値（execution_time, total_nodes, completed_nodes, failed_nodes）
+_GRAPH_RESULT_ATTRS = ("execution_time", "total_nodes", "completed_nodes", "failed_nodes")
+_get_graph_result_attrs = operator.attrgetter(*_GRAPH_RESULT_ATTRS)
+
+
+def _graph_result_metrics(graph_result: Any) -> tuple:
+    """GraphResultの実行時間・ノード数を _GRAPH_RESULT_ATTRS の順で返す（欠けている値は0）。"""
+    try:
+        return _get_graph_result_attrs(graph_result)
+    except AttributeError:
+        # 属性の揃っていない旧バージョンのStrands
+        return tuple(getattr(graph_result, attr, 0) for attr in _GRAPH_RESULT_ATTRS)
+
+
+def build_graph(slack_agent: Agent, tavily_agent: Agent):
+    """
+    slack_agent → tavily_agent の固定構成のGraphを組み立てる。
+
+    Agentは会話履歴（messages）を持つため、同時実行されるリクエスト間で
+    共有できません。Graphもノードの状態を保持するので、Agentと一緒に
+    リクエストごとに組み立てます（組み立て自体はLLM呼び出しに比べて軽量）。
+    """
+    builder = GraphBuilder()
+
+    # ノードを追加
+    builder.add_node(slack_agent, "slack_agent")
+    builder.add_node(tavily_agent, "tavily_agent")
+
+    # エッジを追加
+    # tavily_agentは出力エッジを持たないため、自動的に終了ポイントとなる
+    builder.add_edge("slack_agent", "tavily_agent")
+
+    # エントリーポイントの設定
+    builder.set_entry_point("slack_agent")
+
+    return builder.build()
+
+
+def _tokens(result: Any) -> int:
+    """GraphResult/NodeResultの累計トークン数を返す（usageが無ければ0）。"""
+    usage = getattr(result, "accumulated_usage", None)
+    return usage.get("totalTokens", 0) if usage else 0
+
+
+def _build_node_data(node_name: str, node_result: Any) -> tuple[dict, list[str]]:
+    """NodeResultを構造化レスポンスのエージェント要素に変換する。
+
+    Returns:
+        tuple: (エージェント要素のdict, ノードが出力したテキストの一覧)
+    """
+    node_data = {
+        "name": node_name,
+        "messages": [],
+        "execution_time_ms": getattr(node_result, "execution_time", 0),
+        "status": str(getattr(node_result, "status", "unknown")),
+        "tokens_used": _tokens(node_result)
+    }
+    texts: list[str] = []
+    # ループ内の属性参照・辞書参照を避けるためローカルに束縛
+    messages_append = node_data["messages"].append
+    texts_append = texts.append
+
+    # NodeResult.get_agent_results() で入れ子もフラットに
+    for agent_result in node_result.get_agent_results():
+        text, jsons = extract_message_content(agent_result)
+
+        if text:
+            messages_append({
+                "type": "text",
+                "content": text
+            })
+            texts_append(text)
+
+        if jsons:
+            messages_append({
+                "type": "json",
+                "content": jsons
+            })
+
+        # ログ出力
+        logger.info(
+            "📦 Node: %s | status=%s | stop_reason=%s",
+            node_name, node_data["status"], getattr(agent_result, "stop_reason", None),
+        )
+
+    return node_data, texts
+
+
+# Graph.stream_async() が返すイベント種別
+_NODE_START_EVENT = "multiagent_node_start"
+_NODE_STOP_EVENT = "multiagent_node_stop"
+_RESULT_EVENT = "multiagent_result"
+
+# Graphの各エージェントに与えるシステムプロンプト
+SLACK_SYSTEM_PROMPT = """
+    あなたはSlack統合アシスタントです。
+    「test-strands-agents」というチャンネルからURLが添付されているメッセージを丸ごと取得してきてください。
+    """
+
+TAVILY_SYSTEM_PROMPT = """
+    あなたはTavily統合アシスタントです。
+    取得したURLを元に、extractツールを用いて本文を抽出し、内容を要約してください。
+    """
+
+# リクエスト間で共有するResearchAgent（設定は起動時に読み込み済み）
+_RESEARCH_AGENT = ResearchAgent() if _INIT_ERROR is None else None
 
 # AgentCoreアプリケーションを初期化
 app = BedrockAgentCoreApp()
@@ -354,177 +1172,172 @@ async def invoke_agent_graph(payload: Dict[str, Any]):
     
     Yields:
         AgentCore Runtime形式のストリーミングレスポンス
+        - ノード開始ごとに {"type": "node_start", "name": ...}
+        - ノード完了ごとに {"type": "node_result", "name": ..., "messages": [...], ...}
+        - 最後に全体をまとめた構造化レスポンス（"type": "done"）のJSON文字列
     """
     
-    try:
-        # ResearchAgentインスタンスを作成
-        agent_with_identity = ResearchAgent()
-    except ValueError as e:
-        # 環境変数が設定されていない場合のエラー
-        logger.error(f"設定エラー: {e}")
-        yield {"error": f"設定エラー: {str(e)}. GATEWAY_URLとCOGNITO_SCOPE環境変数が設定されていることを確認してください。"}
-        return
-    except Exception as e:
-        # その他の初期化エラー
-        logger.error(f"初期化エラー: {e}")
-        yield {"error": f"エージェントの初期化に失敗しました: {str(e)}"}
-        return
-    
-    # プロンプトの検証とペイロード構造の処理
+    # プロンプトの検証とペイロード構造の処理（他の処理より先に行い、不正な入力は即座に返す）
     user_message = parse_prompt_from_payload(payload)
     
     if not user_message:
-        logger.error(f"無効なペイロード構造: {payload}")
+        logger.error("無効なペイロード構造: %s", payload)
         yield {"error": "無効なペイロード: 'prompt'フィールドが必要です"}
         return
     
-    # システムプロンプトを定義
-    slack_agent_system_prompt = """
-    あなたはSlack統合アシスタントです。
-    「test-strands-agents」というチャンネルからURLが添付されているメッセージを丸ごと取得してきてください。
-    """
+    if _INIT_ERROR is not None:
+        # 環境変数が設定されていない場合のエラー（起動時に検出済み）
+        yield {"error": f"設定エラー: {_INIT_ERROR}. GATEWAY_URLとCOGNITO_SCOPE環境変数が設定されていることを確認してください。"}
+        return
 
-    tavily_agent_system_prompt = """
-    あなたはTavily統合アシスタントです。
-    取得したURLを元に、extractツールを用いて本文を抽出し、内容を要約してください。
-    """
+    agent_with_identity = _RESEARCH_AGENT
+    model_id = parse_model_id_from_payload(payload) or MODEL_ID
+
+    # use_cache を指定した場合のみ、同じ依頼の応答がキャッシュにあればGraphを実行せずに返す
+    use_cache = bool(_get_payload_option(payload, "use_cache"))
+    cache_key = _result_cache_key(user_message, model_id)
+    cached_response = _get_cached_result(cache_key) if use_cache else None
+    if cached_response is not None:
+        logger.info("♻️ キャッシュ済みの応答を返します")
+        yield _json_dumps({
+            **cached_response,
+            "cached": True,
+            "metadata": {**cached_response["metadata"], "session_id": payload.get("sessionId", "unknown")},
+        })
+        return
     
     try:
-        # MCPクライアントとツールを作成
-        logger.info("🚀 MCPクライアント作成を開始...")
-        mcp_client = await agent_with_identity.create_mcp_client_and_tools()
+        # プロセス内で共有しているMCPクライアントを取得（未接続なら接続し、処理後にプールへ返す）
+        async with agent_with_identity.mcp_session() as mcp_client:
+            logger.debug("🚀 MCPクライアントを借用中...")
+            logger.debug("✅ MCPセッションアクティブ")
         
-        # MCPのwithコンテキスト内でGraph全体を実行
-        logger.info("📦 MCPコンテキストを開始（セッション維持）...")
-        with mcp_client:
-            logger.info("✅ MCPコンテキストに入りました - セッションアクティブ")
-            
-            slack_agent = SlackAgentFactory(
-                model_id=os.environ.get("MODEL_ID", "us.anthropic.claude-sonnet-4-20250514-v1:0"),
-                system_prompt=slack_agent_system_prompt,
-            ).build(mcp_client)
-            
-            tavily_agent = TavilyAgentFactory(
-                model_id=os.environ.get("MODEL_ID", "us.anthropic.claude-sonnet-4-20250514-v1:0"),
-                system_prompt=tavily_agent_system_prompt,
-            ).build(mcp_client)
-            
-            block_agent = Agent()
+            slack_factory = SlackAgentFactory(
+                model_id=model_id,
+                system_prompt=SLACK_SYSTEM_PROMPT,
+            )
+            tavily_factory = TavilyAgentFactory(
+                model_id=model_id,
+                system_prompt=TAVILY_SYSTEM_PROMPT,
+            )
 
-            # Graphを作成していく
-            builder = GraphBuilder()
-            
-            # ノードを追加
-            builder.add_node(slack_agent, "slack_agent")
-            builder.add_node(tavily_agent, "tavily_agent")
-            builder.add_node(block_agent, "block_agent")
+            # ツール列挙は1回だけ行い、両エージェントで共有する
+            tool_partition = await agent_with_identity.get_tool_partition(mcp_client)
+            slack_agent = await slack_factory.build(mcp_client, tool_partition=tool_partition)
+            tavily_agent = await tavily_factory.build(mcp_client, tool_partition=tool_partition)
+        
+            # Graphを作成する（構成は固定、ノードのAgentだけがリクエストごと）
+            graph = build_graph(slack_agent, tavily_agent)
 
-            # エッジを追加
-            builder.add_edge("slack_agent", "tavily_agent")
-            
-            # tavily_agentの後に条件付きエッジを追加（常にFalseで終了）
-            # これによりtavily_agentの後でグラフが確実に終了する
-            builder.add_edge("tavily_agent", "block_agent", condition=always_false_condition)
+            # ユーザーメッセージはすでに取得済み
+            logger.debug("ユーザーメッセージ: %s", user_message)
 
-            # エントリーポイントの設定
-            builder.set_entry_point("slack_agent")
+            # MCPコンテキスト内で処理を実行
+            logger.debug("🎯 MCPコンテキスト内でエージェント処理を開始...")
+        
+            # Graph.stream_async()でノード単位に結果を返しながら非同期実行
+            # （graph(...) の同期呼び出しはGraph完了までイベントループを占有してしまう）
+            try:
+                graph_result = None
+                # ストリーミング中に構築済みのノード結果（最終レスポンスで再利用）
+                streamed_nodes: dict[str, tuple[dict, list[str]]] = {}
 
-            # Graphをビルドする
-            graph = builder.build()
+                if hasattr(graph, "stream_async"):
+                    logger.debug("🚀 Graph.stream_async()を開始...")
+                    async for event in graph.stream_async(user_message):
+                        event_type = event.get("type")
+                        if event_type == _NODE_START_EVENT:
+                            # どのエージェントが処理中かを最初のノード完了より前に知らせる
+                            yield {"type": "node_start", "name": event.get("node_id")}
+                        elif event_type == _NODE_STOP_EVENT:
+                            node_name = event.get("node_id")
+                            node_data, texts = _build_node_data(node_name, event.get("node_result"))
+                            streamed_nodes[node_name] = (node_data, texts)
+                            # 完了したノードの結果をすぐにクライアントへ返す
+                            yield {"type": "node_result", **node_data}
+                        elif event_type == _RESULT_EVENT or "result" in event:
+                            graph_result = event.get("result")
+                else:
+                    # stream_async を持たない旧バージョンのStrands
+                    logger.debug("🚀 Graph.invoke_async()を開始...")
+                    graph_result = await graph.invoke_async(user_message)
 
-            # ユーザーメッセージはすでに取得済み
-            logger.info(f"ユーザーメッセージ: {user_message}")
+                if graph_result is None:
+                    raise RuntimeError("Graphの実行結果を取得できませんでした")
 
-            # MCPコンテキスト内で処理を実行
-            logger.info("🎯 MCPコンテキスト内でエージェント処理を開始...")
+                # ツール呼び出しの通信エラーは例外にならずエラー結果として会話に残るため、
+                # 見つかればセッションが壊れているとみなし次回は新しいクライアントで接続する
+                tool_errors = tool_error_results((slack_agent, tavily_agent))
+                if any(map(is_mcp_call_failure, tool_errors)):
+                    logger.warning("⚠️ MCPツール呼び出しの失敗を検出したためセッションを破棄します")
+                    await _MCP_POOL.discard(mcp_client)
             
-            # Graph.invoke_async()を使用して非同期実行
-            # tavily_agentは出力エッジを持たないため、自動的に終了ポイントとなる
-            try:
-                # 非同期実行でGraphを実行
-                logger.info("🚀 Graph.invoke_async()を開始...")
-                graph_result = graph(user_message)
-                
                 # 結果の処理（graph_with_tool_response_format.mdに基づく改善版）
-                logger.info("🔍 Graph実行結果を処理中...")
-                from strands.multiagent.base import Status
+                logger.debug("🔍 Graph実行結果を処理中...")
 
-                # 構造化されたレスポンスを作成
+                # 構造化されたレスポンスを作成（type=done は最終レスポンスの目印）
+                execution_time, total_nodes, completed_nodes, failed_nodes = _graph_result_metrics(graph_result)
                 structured_response = {
+                    "type": "done",
                     "status": "completed" if graph_result.status == Status.COMPLETED else "failed",
                     "agents": [],
-                    "total_execution_time_ms": getattr(graph_result, "execution_time", 0),
-                    "total_tokens": graph_result.accumulated_usage.get("totalTokens", 0) if hasattr(graph_result, "accumulated_usage") else 0,
+                    "total_execution_time_ms": execution_time,
+                    "total_tokens": _tokens(graph_result),
                     "mcp_tools_used": False,
                     "full_text": "",  # フロントエンド表示用の統合テキスト
                     "metadata": {
                         "session_id": payload.get("sessionId", "unknown"),
-                        "total_nodes": getattr(graph_result, "total_nodes", 0),
-                        "completed_nodes": getattr(graph_result, "completed_nodes", 0),
-                        "failed_nodes": getattr(graph_result, "failed_nodes", 0)
+                        "total_nodes": total_nodes,
+                        "completed_nodes": completed_nodes,
+                        "failed_nodes": failed_nodes
                     }
                 }
 
-                all_texts = []
-                logger.info(f"📊 Graph全体ステータス: {structured_response['status']}")
+                # 統合テキストは1つのバッファへ直接書き込む（中間文字列を作らない）
+                full_text = io.StringIO()
+                write = full_text.write
+                agents_append = structured_response["agents"].append
+                logger.info("📊 Graph全体ステータス: %s", structured_response["status"])
 
-                # 各ノードの結果を処理
+                # 各ノードの結果を処理（ストリーミング中に処理済みのノードは再利用）
                 for node_name, node_result in graph_result.results.items():
-                    node_data = {
-                        "name": node_name,
-                        "messages": [],
-                        "execution_time_ms": getattr(node_result, "execution_time", 0),
-                        "status": str(getattr(node_result, "status", "unknown")),
-                        "tokens_used": node_result.accumulated_usage.get("totalTokens", 0) if hasattr(node_result, "accumulated_usage") else 0
-                    }
-                    
-                    # NodeResult.get_agent_results() で入れ子もフラットに
-                    for agent_result in node_result.get_agent_results():
-                        text, jsons = extract_message_content(agent_result)
-                        
-                        if text:
-                            node_data["messages"].append({
-                                "type": "text",
-                                "content": text
-                            })
-                            all_texts.append(f"[{node_name}] {text}")
-                            
-                            # MCPツール使用を検出
-                            if detect_mcp_usage(text):
-                                structured_response["mcp_tools_used"] = True
-                        
-                        if jsons:
-                            node_data["messages"].append({
-                                "type": "json",
-                                "content": jsons
-                            })
-                        
-                        # ログ出力
-                        logger.info(
-                            f"📦 Node: {node_name} | status={node_data['status']} | "
-                            f"stop_reason={getattr(agent_result,'stop_reason',None)}"
-                        )
-                    
-                    structured_response["agents"].append(node_data)
+                    node_data, texts = streamed_nodes.get(node_name) or _build_node_data(node_name, node_result)
 
-                # 全体の統合テキストを作成
-                structured_response["full_text"] = "\n\n".join(all_texts) if all_texts else "レスポンスが空でした"
+                    for text in texts:
+                        if full_text.tell():
+                            write("\n\n")
+                        write("[")
+                        write(node_name)
+                        write("] ")
+                        write(text)
+                        # MCPツール使用を検出（一度検出したら以降の走査は省略）
+                        if not structured_response["mcp_tools_used"] and detect_mcp_usage(text):
+                            structured_response["mcp_tools_used"] = True
                 
+                    agents_append(node_data)
+
+                # 全体の統合テキストを作成
+                structured_response["full_text"] = full_text.getvalue() or "レスポンスが空でした"
+            
                 # 結果をログ出力
-                logger.info(f"✅ 最終レスポンス準備完了: {len(structured_response['full_text'])} 文字")
-                logger.info(f"📊 MCPツール使用: {structured_response['mcp_tools_used']}")
-                logger.info(f"⏱️ 総実行時間: {structured_response['total_execution_time_ms']}ms")
-                logger.info(f"🎯 トークン使用量: {structured_response['total_tokens']}")
-                
+                logger.info("✅ 最終レスポンス準備完了: %d 文字", len(structured_response["full_text"]))
+                logger.info("📊 MCPツール使用: %s", structured_response["mcp_tools_used"])
+                logger.info("⏱️ 総実行時間: %sms", structured_response["total_execution_time_ms"])
+                logger.info("🎯 トークン使用量: %s", structured_response["total_tokens"])
+            
+                # 正常に完了し、ツールのエラー結果を含まない応答のみキャッシュする
+                if use_cache and structured_response["status"] == "completed" and not tool_errors:
+                    _store_cached_result(cache_key, structured_response)
+
                 # 構造化されたレスポンスをJSON形式で返す
-                yield json.dumps(structured_response, ensure_ascii=False)
-                
+                yield _json_dumps(structured_response)
+            
             except Exception as graph_error:
-                logger.error(f"Graph実行中にエラーが発生: {graph_error}")
-                # エラーの詳細をログ出力
-                import traceback
-                logger.error(f"スタックトレース: {traceback.format_exc()}")
-                
+                # エラーの詳細（スタックトレース）はハンドラが出力する時だけ整形される
+                logger.error("Graph実行中にエラーが発生: %s", graph_error, exc_info=True)
+                # 例外はここで止めるため、セッションはプールに返す前に破棄扱いにする
+                await _MCP_POOL.discard(mcp_client)
+            
                 # エラーレスポンスを返す
                 yield {
                     "type": "error",
@@ -532,23 +1345,39 @@ async def invoke_agent_graph(payload: Dict[str, Any]):
                 }
                 return
 
-            logger.info("🎉 Graph処理完了 - MCPセッションを正常にクローズします")
-                
+            logger.info("🎉 Graph処理完了 - MCPセッションは次のリクエストで再利用します")
+            
+    # セッション利用中に送出された例外の場合、そのセッションは mcp_session() を抜ける際に
+    # 破棄済みのため、ここで張り替える必要はない（他のリクエストが張り直した新しいセッションを壊さない）
+    except MCPClientInitializationError as e:
+        # Gatewayとのセッションを開始できなかった（プールには登録されていない）
+        logger.error("❌ MCPクライアント初期化エラー: %s", e)
+        yield {"error": f"MCP接続エラー: {e}. Gatewayに接続できませんでした。"}
+    except (TimeoutError, asyncio.TimeoutError) as e:
+        # 高負荷時に起こりやすいため、スタックトレースは出さずに再接続だけ促す
+        logger.warning("⏱️ MCP呼び出しがタイムアウトしました: %s", e)
+        yield {"error": f"タイムアウト: {e}. しばらくしてから再度お試しください。"}
     except RuntimeError as e:
         # create_agentからのエラー
-        logger.error(f"❌ エージェント作成エラー: {e}")
+        logger.error("❌ エージェント作成エラー: %s", e)
         yield {"error": str(e)}
     except Exception as e:
-        import traceback
-        error_trace = traceback.format_exc()
-        logger.error(f"❌ 処理中にエラーが発生: {e}")
-        logger.error(f"📊 詳細なスタックトレース:\n{error_trace}")
+        # 上記以外の想定外のエラー（ストリームを途切れさせずエラーとして返す）
+        # asyncio.CancelledError は BaseException なのでここでは捕まえず伝播させる
+        logger.error("❌ 処理中にエラーが発生: %s", e, exc_info=True)
         
         # エラーメッセージを改善
         error_msg = str(e)
-        if "connection" in error_msg.lower() or "mcp" in error_msg.lower():
+        if "401" in error_msg or "unauthorized" in error_msg.lower():
+            # トークンが失効している可能性があるため取り直させる
+            # （セッション利用中の例外であれば、セッションは mcp_session() が破棄済み）
+            agent_with_identity.invalidate_access_token()
+            yield {"error": f"認証エラー: {error_msg}. アクセストークンを再取得して再接続します。"}
+        elif "connection" in error_msg.lower() or "mcp" in error_msg.lower():
             yield {"error": f"MCP接続エラー: {error_msg}. MCPクライアントのセッションが切れている可能性があります。"}
         elif "tool" in error_msg.lower():
+            # ツール構成が変わった可能性があるため、次回はツール一覧を取り直す
+            invalidate_tools_cache(agent_with_identity.gateway_url)
             yield {"error": f"ツール実行エラー: {error_msg}. ツールの利用権限またはパラメータを確認してください。"}
         else:
             yield {"error": f"リクエストの処理中にエラーが発生しました: {error_msg}"}
@@ -7,12 +7,37 @@ import streamlit as st
 import boto3
 from botocore.config import Config
 import json
+import io
 import os
-from datetime import datetime
-from typing import Dict, Any, Optional
+import re
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Any, Iterator, Optional, Tuple
 import logging
 from dotenv import load_dotenv
 
+# 高速なJSONパーサー（任意依存。orjson → ujson → 標準ライブラリの順で使用）
+# _dumps_bytes はリクエストのペイロード用（UTF-8のbytesを返す）
+# 整形表示用の dumps(indent=2) は標準ライブラリの json を使う
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps_bytes = orjson.dumps
+except ImportError:
+    try:
+        import ujson
+        _loads = ujson.loads
+    except ImportError:
+        _loads = json.loads
+
+    def _dumps_bytes(obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+
 # 環境変数をロード（オプション：AGENT_RUNTIME_ARNなど）
 load_dotenv()
 
@@ -27,12 +52,163 @@ st.set_page_config(
     layout="wide"
 )
 
-# セッション状態の初期化
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+
+@dataclass
+class RuntimeSettings:
+    """AgentCore Runtimeの呼び出し設定（スクリプト実行ごとに環境変数から一度だけ読み込む）"""
+    agent_runtime_arn: str
+    runtime_user_id: str
+
+
+# サイドバーで変更された場合は os.environ（次回の再実行用）とこのオブジェクトの両方を更新する
+SETTINGS = RuntimeSettings(
+    agent_runtime_arn=os.getenv("AGENT_RUNTIME_ARN", ""),
+    runtime_user_id=os.getenv("RUNTIME_USER_ID", "m2m-user-001"),
+)
+
+# 会話履歴の保存先（SQLiteファイル）と、画面用にメモリへ保持する件数
+HISTORY_DIR = os.getenv("CHAT_HISTORY_DIR", ".memory")
+HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+# チャット画面に常に表示する直近の件数（それより前は折りたたみ内で必要な時だけ描画）
+VISIBLE_MESSAGES = int(os.getenv("CHAT_VISIBLE_MESSAGES", "10"))
+# 会話履歴は既定ではブラウザセッションごと。true の場合は Runtime User ID ごとに
+# セッションをまたいで共有する（同じUser IDを使う全員で履歴が見え、クリアも共通になる）
+HISTORY_SHARED_BY_USER = os.getenv("CHAT_HISTORY_SHARED_BY_USER", "false").lower() == "true"
+# 保存した会話履歴を残す日数（これより古いものはセッション開始時に削除）
+HISTORY_RETENTION_DAYS = float(os.getenv("CHAT_HISTORY_RETENTION_DAYS", "7"))
+
+
+@st.cache_resource
+def _init_history_db() -> Optional[str]:
+    """会話履歴DBのテーブルを作成してパスを返す（プロセス内で一度だけ）
+
+    保存先を使えない場合は警告を出して None を返し、履歴はメモリ上だけで保持する。
+    """
+    path = os.path.join(HISTORY_DIR, "history.db")
+    try:
+        os.makedirs(HISTORY_DIR, exist_ok=True)
+        with closing(sqlite3.connect(path)) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, history_key TEXT NOT NULL, "
+                "role TEXT NOT NULL, content TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_key ON chat_messages (history_key, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_ts ON chat_messages (ts)")
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"⚠️ 会話履歴DBを利用できないため、履歴はメモリ上だけで保持します: {e}")
+        return None
+    return path
+
+
+@contextmanager
+def history_db() -> Iterator[sqlite3.Connection]:
+    """会話履歴DBに接続する（使い終わったら閉じるため、セッションが増えても接続は残らない）
+
+    呼び出し前に _init_history_db() が None でないことを確認すること。
+    """
+    conn = sqlite3.connect(_init_history_db(), isolation_level=None)  # 自動コミット
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _history_key() -> str:
+    """会話履歴の持ち主（既定はブラウザセッション。共有設定時は Runtime User ID）"""
+    if HISTORY_SHARED_BY_USER:
+        return f"user:{SETTINGS.runtime_user_id}"
+    return f"session:{st.session_state.session_id}"
+
+
+def load_recent_messages(limit: int = HISTORY_WINDOW) -> list:
+    """直近の会話履歴をSQLiteから古い順に読み込む（limit=-1 で全件）"""
+    if _init_history_db() is None:
+        # DBを使えない場合はメモリ上の履歴だけが対象
+        messages = list(st.session_state.get("messages", ()))
+        return messages if limit < 0 else messages[-limit:]
+    try:
+        with history_db() as conn:
+            rows = conn.execute(
+                "SELECT role, content FROM chat_messages WHERE history_key = ? ORDER BY id DESC LIMIT ?",
+                (_history_key(), limit),
+            ).fetchall()
+    except sqlite3.Error as e:
+        logger.warning(f"会話履歴の読み込みに失敗: {e}")
+        return []
+    return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+
+def count_messages() -> int:
+    """保存済みの会話履歴の件数"""
+    if _init_history_db() is None:
+        return len(st.session_state.messages)
+    try:
+        with history_db() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM chat_messages WHERE history_key = ?", (_history_key(),)
+            ).fetchone()[0]
+    except sqlite3.Error as e:
+        logger.warning(f"会話履歴の件数取得に失敗: {e}")
+        return len(st.session_state.messages)
+
+
+def add_messages(*entries: Tuple[str, str]) -> None:
+    """会話履歴に (role, content) をまとめて追加（SQLiteに保存し、メモリ上は直近 HISTORY_WINDOW 件だけ保持）
+
+    1回の入力で増えるメッセージ（ユーザー + アシスタント）は session_state への
+    1回の代入で反映する。メモリ上の履歴は描画で走査するだけなので tuple で持つ。
+    """
+    if not entries:
+        return
+    if _init_history_db() is not None:
+        now = time.time()
+        key = _history_key()
+        try:
+            with history_db() as conn:
+                conn.executemany(
+                    "INSERT INTO chat_messages (history_key, role, content, ts) VALUES (?, ?, ?, ?)",
+                    [(key, role, content, now) for role, content in entries],
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"会話履歴の保存に失敗: {e}")
+    st.session_state.messages = (
+        *st.session_state.messages,
+        *({"role": role, "content": content} for role, content in entries),
+    )[-HISTORY_WINDOW:]
+
+
+def clear_messages() -> None:
+    """会話履歴を削除（このセッション、共有設定時は同じ Runtime User ID の分だけ）"""
+    if _init_history_db() is not None:
+        try:
+            with history_db() as conn:
+                conn.execute("DELETE FROM chat_messages WHERE history_key = ?", (_history_key(),))
+        except sqlite3.Error as e:
+            logger.warning(f"会話履歴の削除に失敗: {e}")
+    st.session_state.messages = ()
+
+
+def prune_old_messages() -> None:
+    """保存期間（HISTORY_RETENTION_DAYS）を過ぎた会話履歴を削除する"""
+    if _init_history_db() is None:
+        return
+    try:
+        with history_db() as conn:
+            conn.execute(
+                "DELETE FROM chat_messages WHERE ts < ?",
+                (time.time() - HISTORY_RETENTION_DAYS * 86400,),
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"古い会話履歴の削除に失敗: {e}")
+
+
+# セッション状態の初期化（履歴の読み込みはセッションIDを決めてから行う）
 if "session_id" not in st.session_state:
-    import uuid
     st.session_state.session_id = str(uuid.uuid4())
+if "messages" not in st.session_state:
+    prune_old_messages()
+    st.session_state.messages = tuple(load_recent_messages())
 
 # タイムアウト設定を含むboto3設定
 boto_config = Config(
@@ -41,20 +217,154 @@ boto_config = Config(
     retries={
         'max_attempts': 3,
         'mode': 'standard'
-    }
+    },
+    max_pool_connections=50,  # 複数セッションからの同時呼び出しで接続を張り直さないように
+    tcp_keepalive=True,  # 長時間の応答待ちでもコネクションを維持
 )
 
-# Bedrock AgentCoreクライアントを初期化（タイムアウト設定付き）
-try:
-    agent_core_client = boto3.client('bedrock-agentcore', config=boto_config)
-except Exception as e:
-    logger.error(f"AgentCore クライアントの初期化に失敗: {e}")
-    agent_core_client = None
+
+@st.cache_resource
+def get_agent_core_client():
+    """Bedrock AgentCoreクライアントを作成（再実行・セッションをまたいでプロセス内で1つを共有）"""
+    return boto3.client('bedrock-agentcore', config=boto_config)
+
+
+# SSE/NDJSONの1行: 前後の空白と"data: "プレフィックスを除いた本体をグループ1に取る（空行は対象外）
+_SSE_LINE_RE = re.compile(r"^[ \t\r\f\v]*(?:data: )?([^\n]*?\S)[ \t\r\f\v]*$", re.MULTILINE)
+# SSEの行の先頭（コメント行 ":"、または id/retry/data/event フィールド）
+_SSE_FIELD_RE = re.compile(r":|id:|retry:|data:|event:")
+
+
+def _may_be_final_line(line: str) -> bool:
+    """ストリーミングの1行が最終結果（文字列・エラー・構造化レスポンス）になり得るかを文字列検索で判定"""
+    return line.startswith('"') or '"error"' in line or '"agents"' in line
+
+
+def _text_result(message: str) -> Dict[str, Any]:
+    """JSON文字列として届いたテキストを結果にする
+
+    AgentCore Runtimeは最終レスポンス（構造化JSONの文字列）をさらにJSON文字列として返すため、
+    中身が構造化レスポンス（"agents" と "status" を持つオブジェクト）であればここで一度だけ解析する。
+    """
+    stripped = message.strip()
+    if stripped.startswith('{') and stripped.endswith('}'):
+        try:
+            inner = _loads(stripped)
+        except ValueError:
+            inner = None
+        if isinstance(inner, dict) and "agents" in inner and "status" in inner:
+            logger.info("テキストレスポンス内に構造化JSONを検出")
+            return {
+                "type": "structured",
+                "data": inner
+            }
+    return {
+        "type": "text",
+        "message": message
+    }
+
+
+def _parse_stream_line(line: str) -> Optional[Dict[str, Any]]:
+    """ストリーミングレスポンスの1行を解析し、最終結果であれば表示用の結果を返す（それ以外はNone）"""
+    line = line.strip()
+    if not line:
+        return None
+    
+    # "data: "プレフィックスを除去
+    if line.startswith("data: "):
+        line = line[6:]
+    
+    return _parse_stream_payload(line)
+
+
+def _parse_stream_payload(line: str) -> Optional[Dict[str, Any]]:
+    """前後の空白と "data: " プレフィックスを除去済みの1行を解析する（_parse_stream_line の本体）"""
+    # 結果になり得ない行（node_start / node_result などの途中経過）はパースせずに読み飛ばす
+    # （採用するのは文字列か、"error" / "agents" キーを持つオブジェクトだけ）
+    if not _may_be_final_line(line):
+        return None
+    
+    # JSONとしてパース
+    try:
+        data = _loads(line)
+    except ValueError:
+        return None
+    
+    # エラーレスポンスの処理
+    if isinstance(data, dict) and "error" in data:
+        return {
+            "type": "error",
+            "message": data["error"]
+        }
+    
+    # 構造化レスポンスの処理
+    if isinstance(data, dict) and "agents" in data:
+        logger.info("ストリーミング形式から構造化レスポンスを検出")
+        return {
+            "type": "structured",
+            "data": data
+        }
+    
+    # 通常のテキストレスポンス（中身が構造化レスポンスのJSONであれば構造化として扱う）
+    if isinstance(data, str):
+        return _text_result(data)
+    
+    return None
 
 
-def process_agent_response(agent_response):
+def _parse_progress_event(line: str) -> Optional[Dict[str, Any]]:
+    """途中経過の行（node_start / node_result）であればイベントのdictを返す"""
+    line = line.strip()
+    if line.startswith("data: "):
+        line = line[6:]
+    if '"node_' not in line:
+        return None
+    try:
+        data = _loads(line)
+    except ValueError:
+        return None
+    if isinstance(data, dict) and data.get("type") in ("node_start", "node_result"):
+        return data
+    return None
+
+
+def _process_event_stream(body, on_event=None) -> Dict[str, Any]:
+    """SSEレスポンスを1行ずつ読み、最終結果が届いた時点で残りを読まずに返す
+
+    on_event を渡した場合は、途中経過（node_start / node_result）を受信順に通知する。
+    """
+    raw_lines = []
+    try:
+        for raw_line in body.iter_lines(chunk_size=65536):
+            line = raw_line.decode("utf-8")
+            raw_lines.append(line)
+            result = _parse_stream_line(line)
+            if result:
+                return result
+            if on_event is not None:
+                event = _parse_progress_event(line)
+                if event:
+                    on_event(event)
+    finally:
+        body.close()
+    
+    # 最終結果が見つからなかった場合はプレーンテキストとして扱う
+    response_str = "\n".join(raw_lines)
+    if not response_str.strip():
+        return {"type": "empty", "message": "レスポンスが空でした"}
+    return {
+        "type": "text",
+        "message": response_str
+    }
+
+
+def process_agent_response(agent_response, on_event=None):
     """AgentCore Runtimeからのレスポンスを処理（構造化レスポンス対応）"""
     try:
+        # ストリーミング（SSE）の場合は全体を読み込まずに行単位で処理
+        if "text/event-stream" in agent_response.get("contentType", ""):
+            return _process_event_stream(agent_response["response"], on_event)
+        
         response_data = agent_response["response"].read()
         
         # レスポンスデータをログ出力（デバッグ用）
@@ -72,83 +382,58 @@ def process_agent_response(agent_response):
         
         logger.debug(f"レスポンス内容の先頭100文字: {response_str[:100]}")
         
-        # 複数のJSON解析戦略を試行
+        # 先頭の文字でフォーマットを一度だけ判定し、該当する解析だけを行う
+        # （JSON → 戦略1（失敗時はNDJSONとして戦略2）、SSE → 戦略2、それ以外 → 戦略3）
+        head = response_str.lstrip()[:8]
+        if head[:1] in ('{', '[', '"'):
+            response_format = "json"
+        elif _SSE_FIELD_RE.match(head):
+            response_format = "sse"
+        else:
+            response_format = "text"
         
         # 戦略1: 直接JSONとしてパース（構造化レスポンスの場合）
-        try:
-            data = json.loads(response_str)
+        if response_format == "json":
+            try:
+                data = _loads(response_str)
             
-            # エラーレスポンスの処理
-            if isinstance(data, dict) and "error" in data:
-                return {
-                    "type": "error",
-                    "message": data["error"]
-                }
+                # エラーレスポンスの処理
+                if isinstance(data, dict) and "error" in data:
+                    return {
+                        "type": "error",
+                        "message": data["error"]
+                    }
             
-            # 構造化レスポンスの処理
-            if isinstance(data, dict) and "agents" in data:
-                logger.info("構造化レスポンスを検出しました")
-                return {
-                    "type": "structured",
-                    "data": data
-                }
+                # 構造化レスポンスの処理
+                if isinstance(data, dict) and "agents" in data:
+                    logger.info("構造化レスポンスを検出しました")
+                    return {
+                        "type": "structured",
+                        "data": data
+                    }
             
-            # 通常のJSONレスポンス
-            if isinstance(data, dict) or isinstance(data, list):
-                return {
-                    "type": "structured",
-                    "data": data
-                }
+                # 通常のJSONレスポンス
+                if isinstance(data, dict) or isinstance(data, list):
+                    return {
+                        "type": "structured",
+                        "data": data
+                    }
             
-            # テキストレスポンス
-            if isinstance(data, str):
-                return {
-                    "type": "text",
-                    "message": data
-                }
+                # テキストレスポンス（中身が構造化レスポンスのJSONであれば構造化として扱う）
+                if isinstance(data, str):
+                    return _text_result(data)
                 
-        except json.JSONDecodeError:
-            logger.debug("直接JSONパースに失敗、ストリーミング形式を試行")
+            except ValueError:  # JSONDecodeError（ujsonはValueError）
+                logger.debug("直接JSONパースに失敗、ストリーミング形式を試行")
         
         # 戦略2: 改行区切りのストリーミングレスポンスを処理
         try:
-            for line in response_str.split("\n"):
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                # "data: "プレフィックスを除去
-                if line.startswith("data: "):
-                    line = line[6:]
-                
-                # JSONとしてパース
-                try:
-                    data = json.loads(line)
-                    
-                    # エラーレスポンスの処理
-                    if isinstance(data, dict) and "error" in data:
-                        return {
-                            "type": "error",
-                            "message": data["error"]
-                        }
-                    
-                    # 構造化レスポンスの処理
-                    if isinstance(data, dict) and "agents" in data:
-                        logger.info("ストリーミング形式から構造化レスポンスを検出")
-                        return {
-                            "type": "structured",
-                            "data": data
-                        }
-                    
-                    # 通常のテキストレスポンス
-                    if isinstance(data, str):
-                        return {
-                            "type": "text",
-                            "message": data
-                        }
-                    
-                except json.JSONDecodeError:
-                    continue
+            if response_format != "text":
+                # 行の分割・前後の空白と"data: "の除去を正規表現で1パスに行う（行リストは作らない）
+                for match in _SSE_LINE_RE.finditer(response_str):
+                    result = _parse_stream_payload(match.group(1))
+                    if result:
+                        return result
         except Exception as e:
             logger.debug(f"ストリーミング形式の処理中にエラー: {e}")
         
@@ -166,14 +451,75 @@ def process_agent_response(agent_response):
         }
 
 
-def format_structured_response(data: Dict[str, Any]) -> str:
-    """構造化レスポンスをMarkdown形式にフォーマット"""
-    lines = []
+# エージェント名（Graphのノード名）→ 表示名
+_DISPLAY_NAMES = {
+    "slack_agent": "Slackエージェント",
+    "tavily_agent": "Tavilyエージェント",
+    "block_agent": "ブロックエージェント"
+}
+# 完了したかどうか → (アイコン, 表示テキスト)
+_STATUS_HEADERS = {True: ("✅", "処理完了"), False: ("❌", "処理失敗")}
+
+
+def _format_agent_section(agent: Dict[str, Any]) -> str:
+    """1エージェント分の結果をMarkdownにする"""
+    buf = io.StringIO()
+    w = buf.write
+    agent_name = agent.get("name", "Unknown")
+    
+    # エージェント名を見やすく変換
+    display_name = _DISPLAY_NAMES.get(agent_name, agent_name)
+    
+    # エージェント名と実行時間を同じ行に
+    w(f"#### 📦 **{display_name}**")
+    if agent.get("execution_time_ms"):
+        time_sec = agent["execution_time_ms"] / 1000
+        w(f" *(実行時間: {time_sec:.2f}秒)*")
+    w("\n")
     
+    # メッセージを整形
+    has_content = False
+    for msg in agent.get("messages", []):
+        if msg["type"] == "text":
+            content = msg['content'].strip()
+            if content:
+                has_content = True
+                # インデントを追加して見やすく
+                w("\n")
+                # 複数行のテキストを適切に処理（空白だけの行は出力しない）
+                for line in content.split('\n'):
+                    if line and not line.isspace():
+                        w("> ")
+                        w(line)
+                        w("\n")
+                
+        elif msg["type"] == "json":
+            has_content = True
+            w("\n```json\n")
+            items = msg['content'] if isinstance(msg['content'], list) else [msg['content']]
+            for item in items:
+                w(json.dumps(item, ensure_ascii=False, indent=2))
+                w("\n")
+            w("```\n")
+    
+    # メッセージがない場合
+    if not has_content:
+        if agent.get("status") == "skipped":
+            w("> *（スキップされました）*\n")
+        else:
+            w("> *（出力なし）*\n")
+    return buf.getvalue()
+
+
+def iter_structured_response(data: Dict[str, Any]) -> Iterator[str]:
+    """構造化レスポンスをセクション単位（ヘッダー・エージェントごと・実行詳細）のMarkdownで返す
+
+    st.write_stream は断片が届くたびにそれまでの全文を描画し直すため、
+    行単位ではなくセクション単位にまとめて描画回数をエージェント数程度に抑える。
+    """
     # ステータス情報をコンパクトに表示
-    status_icon = "✅" if data.get("status") == "completed" else "❌"
-    status_text = "処理完了" if data.get("status") == "completed" else "処理失敗"
-    lines.append(f"### {status_icon} {status_text}")
+    status_icon, status_text = _STATUS_HEADERS[data.get("status") == "completed"]
+    header = f"### {status_icon} {status_text}\n"
     
     # 実行統計をインラインで表示
     stats_parts = []
@@ -188,81 +534,27 @@ def format_structured_response(data: Dict[str, Any]) -> str:
         stats_parts.append("🔧 MCPツール使用")
     
     if stats_parts:
-        lines.append(f"*{' | '.join(stats_parts)}*")
+        header += f"*{' | '.join(stats_parts)}*\n"
     
-    lines.append("\n---\n")
+    yield header + "\n---\n\n"
     
     # 各エージェントの結果を整形表示
     if data.get("agents"):
         for i, agent in enumerate(data["agents"]):
-            agent_name = agent.get("name", "Unknown")
-            
-            # エージェント名を見やすく変換
-            display_name = {
-                "slack_agent": "Slackエージェント",
-                "tavily_agent": "Tavilyエージェント",
-                "block_agent": "ブロックエージェント"
-            }.get(agent_name, agent_name)
-            
-            # エージェントヘッダー
-            if i > 0:
-                lines.append("")  # エージェント間にスペースを追加
-            
-            # エージェント名と実行時間を同じ行に
-            agent_header = f"#### 📦 **{display_name}**"
-            if agent.get("execution_time_ms"):
-                time_sec = agent["execution_time_ms"] / 1000
-                agent_header += f" *(実行時間: {time_sec:.2f}秒)*"
-            lines.append(agent_header)
-            
-            # メッセージを整形
-            has_content = False
-            for msg in agent.get("messages", []):
-                if msg["type"] == "text":
-                    content = msg['content'].strip()
-                    if content:
-                        has_content = True
-                        # インデントを追加して見やすく
-                        lines.append("")
-                        # 複数行のテキストを適切に処理
-                        content_lines = content.split('\n')
-                        for line in content_lines:
-                            if line.strip():
-                                lines.append(f"> {line}")
-                        
-                elif msg["type"] == "json":
-                    has_content = True
-                    lines.append("")
-                    lines.append("```json")
-                    if isinstance(msg['content'], list):
-                        for item in msg['content']:
-                            lines.append(json.dumps(item, ensure_ascii=False, indent=2))
-                    else:
-                        lines.append(json.dumps(msg['content'], ensure_ascii=False, indent=2))
-                    lines.append("```")
-            
-            # メッセージがない場合
-            if not has_content:
-                if agent.get("status") == "skipped":
-                    lines.append("> *（スキップされました）*")
-                else:
-                    lines.append("> *（出力なし）*")
+            # エージェントヘッダー（エージェント間にスペースを追加）
+            section = _format_agent_section(agent)
+            yield "\n" + section if i > 0 else section
     
     # フルテキストがある場合（フォールバック）
     elif data.get("full_text"):
-        lines.append("### 📝 処理結果\n")
-        # フルテキストを整形
-        full_text_lines = data["full_text"].split('\n')
-        for line in full_text_lines:
-            if line.strip():
-                lines.append(line)
+        # フルテキストを整形（空白だけの行は出力しない）
+        lines = [line for line in data["full_text"].split('\n') if line and not line.isspace()]
+        yield "### 📝 処理結果\n\n" + "".join(line + "\n" for line in lines)
     
     # メタデータがある場合は最後に追加
     if data.get("metadata"):
         metadata = data["metadata"]
         if any([metadata.get("total_nodes"), metadata.get("completed_nodes")]):
-            lines.append("\n---\n")
-            lines.append("##### 📊 実行詳細")
             details = []
             if metadata.get("total_nodes"):
                 details.append(f"総ノード数: {metadata['total_nodes']}")
@@ -270,9 +562,69 @@ def format_structured_response(data: Dict[str, Any]) -> str:
                 details.append(f"完了: {metadata['completed_nodes']}")
             if metadata.get("failed_nodes", 0) > 0:
                 details.append(f"失敗: {metadata['failed_nodes']}")
-            lines.append(f"*{' | '.join(details)}*")
-    
-    return "\n".join(lines)
+            yield f"\n---\n\n##### 📊 実行詳細\n*{' | '.join(details)}*\n"
+
+
+def format_structured_response(data: Dict[str, Any]) -> str:
+    """構造化レスポンスをMarkdown形式にフォーマット（連結済みの文字列が必要な場合用）"""
+    return "".join(iter_structured_response(data))
+
+
+@st.cache_resource
+def get_invoke_executor() -> ThreadPoolExecutor:
+    """AgentCore呼び出し用のワーカースレッドプール（プロセス内で共有）"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="agentcore-invoke")
+
+
+def invoke_agent_runtime(client, on_event=None, **kwargs) -> Dict[str, Any]:
+    """AgentCore Runtimeを呼び出してレスポンスを処理する（ワーカースレッドで実行）
+
+    client はスクリプトスレッドで取得して渡す（st.cache_resource をワーカーから呼ばない）。
+    """
+    agent_response = client.invoke_agent_runtime(**kwargs)
+    return process_agent_response(agent_response, on_event)
+
+
+def format_progress_event(event: Dict[str, Any]) -> str:
+    """途中経過イベントをストリーミング表示用のMarkdown断片にする"""
+    if event.get("type") == "node_start":
+        name = event.get("name", "Unknown")
+        display_name = _DISPLAY_NAMES.get(name, name)
+        return f"⏳ *{display_name}を実行中...*\n\n"
+    return _format_agent_section(event) + "\n"
+
+
+def run_with_progress(func, **kwargs):
+    """func をワーカースレッドで実行し、完了まで途中経過をストリーミング表示しながら待つ
+
+    スクリプトスレッドは完了までここで待つが、ワーカーからの途中経過の
+    キューを0.5秒ごとにポーリングし、届いた途中経過（ノードの開始・完了）を
+    st.write_stream で逐次描画し、何も届かない間は経過時間を更新する。
+    表示した途中経過は最終結果の描画前に消す。
+    """
+    events: queue.Queue = queue.Queue()
+    future = get_invoke_executor().submit(func, on_event=events.put, **kwargs)
+    progress = st.empty()
+    live = st.empty()
+    started = time.monotonic()
+
+    def stream_progress():
+        while True:
+            try:
+                event = events.get(timeout=0.5)
+            except queue.Empty:
+                if future.done() and events.empty():
+                    return
+                progress.caption(f"⏳ 応答待ち... {time.monotonic() - started:.0f}秒経過")
+                continue
+            yield format_progress_event(event)
+
+    try:
+        live.write_stream(stream_progress())
+        return future.result()
+    finally:
+        progress.empty()
+        live.empty()
 
 
 def render_sidebar():
@@ -284,7 +636,7 @@ def render_sidebar():
         st.subheader("📊 AgentCore Runtime設定")
         
         # AGENT_RUNTIME_ARN
-        agent_runtime_arn = os.getenv("AGENT_RUNTIME_ARN", "")
+        agent_runtime_arn = SETTINGS.agent_runtime_arn
         if agent_runtime_arn:
             st.success(f"✅ AGENT_RUNTIME_ARN: 設定済み")
             with st.expander("ARN詳細"):
@@ -298,14 +650,22 @@ def render_sidebar():
             )
             if arn_input:
                 os.environ["AGENT_RUNTIME_ARN"] = arn_input
+                SETTINGS.agent_runtime_arn = arn_input
                 st.rerun()
         
+        # 応答キャッシュ（既定は無効。Slackの新着メッセージを取りこぼさないため）
+        st.checkbox(
+            "応答キャッシュを使う",
+            key="use_result_cache",
+            help="同じ依頼への応答を一定時間再利用します（その間のSlackの新着メッセージは反映されません）"
+        )
+        
         # M2M認証設定
         st.divider()
         st.subheader("🔐 M2M認証設定")
         
         # Runtime User ID設定
-        current_user_id = os.getenv("RUNTIME_USER_ID", "m2m-user-001")
+        current_user_id = SETTINGS.runtime_user_id
         user_id_input = st.text_input(
             "Runtime User ID",
             value=current_user_id,
@@ -313,6 +673,10 @@ def render_sidebar():
         )
         if user_id_input != current_user_id:
             os.environ["RUNTIME_USER_ID"] = user_id_input
+            SETTINGS.runtime_user_id = user_id_input
+            if HISTORY_SHARED_BY_USER:
+                # 会話履歴をユーザーごとに共有している場合は、切り替えたユーザーの履歴を読み直す
+                st.session_state.messages = tuple(load_recent_messages())
             st.success(f"✅ User ID更新: {user_id_input}")
         
         with st.expander("M2M認証について"):
@@ -327,17 +691,15 @@ def render_sidebar():
         st.divider()
         st.subheader("🔧 AWS設定")
         
-        if agent_core_client:
+        # クライアントは最初のメッセージ送信時に作成するため、それまでは接続を確認しない
+        region = st.session_state.get("agent_core_region")
+        if region is None:
+            st.info("AWS接続は最初のメッセージ送信時に確認します")
+        else:
             st.success("✅ AWS接続: 正常")
             # リージョン情報を表示
-            try:
-                region = agent_core_client.meta.region_name
+            if region:
                 st.info(f"リージョン: {region}")
-            except:
-                pass
-        else:
-            st.error("❌ AWS接続: 失敗")
-            st.info("AWS認証情報を確認してください")
         
         # セッション情報
         st.divider()
@@ -346,7 +708,7 @@ def render_sidebar():
         
         # 会話履歴のクリア
         if st.button("🗑️ 会話履歴をクリア", type="secondary", use_container_width=True):
-            st.session_state.messages = []
+            clear_messages()
             st.rerun()
 
 
@@ -364,12 +726,7 @@ def render_chat_interface():
     """)
     
     # 設定チェック
-    if not agent_core_client:
-        st.error("❌ AWS AgentCoreクライアントが初期化されていません")
-        st.info("AWS認証情報を確認してください")
-        return
-    
-    if not os.getenv("AGENT_RUNTIME_ARN"):
+    if not SETTINGS.agent_runtime_arn:
         st.warning("""
         ⚠️ **Agent Runtime ARNが設定されていません**
         
@@ -377,18 +734,25 @@ def render_chat_interface():
         """)
         return
     
-    # チャット履歴を表示
-    for message in st.session_state.messages:
+    # チャット履歴を表示（直近 VISIBLE_MESSAGES 件のみ常に描画）
+    visible_messages = st.session_state.messages[-VISIBLE_MESSAGES:]
+    hidden_count = count_messages() - len(visible_messages)
+    if hidden_count > 0:
+        with st.expander(f"🕘 以前のメッセージ（{hidden_count}件）"):
+            # 折りたたみ中でも中身は描画されるため、表示を選んだ時だけSQLiteから読み込んで描画する
+            if st.checkbox("以前のメッセージを表示", key="show_older_messages"):
+                for message in load_recent_messages(limit=-1)[:hidden_count]:
+                    with st.chat_message(message["role"]):
+                        st.markdown(message["content"])
+    
+    for message in visible_messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
     
     # チャット入力
     if prompt := st.chat_input("メッセージを入力してください（例：SlackのURLを要約して）"):
-        # ユーザーメッセージを追加
-        st.session_state.messages.append({
-            "role": "user",
-            "content": prompt
-        })
+        # この入力で増えるメッセージ（最後にまとめて履歴へ追加する）
+        new_entries = [("user", prompt)]
         
         # ユーザーメッセージを表示
         with st.chat_message("user"):
@@ -399,35 +763,43 @@ def render_chat_interface():
             response_container = st.container()
             
             try:
+                # AgentCoreクライアントは最初の送信時に作成する（失敗時は下の except でエラー表示）
+                agent_core_client = get_agent_core_client()
+                # サイドバーの接続状態の表示用（次の再実行から反映）
+                st.session_state.agent_core_region = agent_core_client.meta.region_name or ""
+                
                 # ペイロードを作成
-                payload = json.dumps({
+                payload = _dumps_bytes({
                     "input": {
                         "prompt": prompt,
-                        "session_id": st.session_state.session_id
+                        "session_id": st.session_state.session_id,
+                        # 応答キャッシュはオプトイン（サイドバーで有効化した場合のみ）
+                        "use_cache": st.session_state.get("use_result_cache", False),
                     }
-                }).encode()
+                })
                 
                 # AgentCore Runtimeを呼び出し（タイムアウトを延長）
                 with st.spinner("🔄 Agent Graphを実行中...（処理に時間がかかる場合があります）"):
-                    logger.info(f"Agent Runtime呼び出し: ARN={os.getenv('AGENT_RUNTIME_ARN')}")
+                    logger.info(f"Agent Runtime呼び出し: ARN={SETTINGS.agent_runtime_arn}")
                     logger.info(f"セッションID: {st.session_state.session_id}")
                     logger.info(f"タイムアウト設定: 読み取り=600秒（10分）, 接続=120秒（2分）")
                     
                     # runtimeUserIdを設定（M2M認証用）
-                    runtime_user_id = os.getenv("RUNTIME_USER_ID", "m2m-user-001")
+                    runtime_user_id = SETTINGS.runtime_user_id
                     logger.info(f"Runtime User ID: {runtime_user_id}")
                     
-                    agent_response = agent_core_client.invoke_agent_runtime(
-                        agentRuntimeArn=os.getenv("AGENT_RUNTIME_ARN"),
+                    # 呼び出しとレスポンス処理（構造化レスポンス対応）はワーカースレッドで実行し、
+                    # 待っている間は経過時間を表示する
+                    response_result = run_with_progress(
+                        invoke_agent_runtime,
+                        client=agent_core_client,
+                        agentRuntimeArn=SETTINGS.agent_runtime_arn,
                         runtimeSessionId=st.session_state.session_id,
                         payload=payload,
                         qualifier="DEFAULT",
                         runtimeUserId=runtime_user_id  # ユーザーIDをヘッダーに設定
                     )
                     
-                    # レスポンスを処理（構造化レスポンス対応）
-                    response_result = process_agent_response(agent_response)
-                    
                     # レスポンスタイプに応じて表示
                     if response_result["type"] == "error":
                         response_container.error(f"❌ {response_result['message']}")
@@ -438,48 +810,20 @@ def render_chat_interface():
                         display_content = response_result['message']
                     
                     elif response_result["type"] == "structured":
-                        # 構造化レスポンスをフォーマット
-                        formatted_response = format_structured_response(response_result['data'])
-                        response_container.markdown(formatted_response)
-                        display_content = formatted_response
+                        # 構造化レスポンスをセクションごとに描画（戻り値は連結済みの全文）
+                        display_content = response_container.write_stream(
+                            iter_structured_response(response_result['data'])
+                        )
                         
                         # デバッグ情報を展開可能セクションに表示
                         with response_container.expander("🔍 詳細情報"):
                             st.json(response_result['data'])
                     
                     elif response_result["type"] == "text":
-                        # テキストレスポンスがJSON形式の場合を検出
+                        # 構造化JSONを含むテキストは process_agent_response で判定済み
                         message = response_result['message']
-                        
-                        # JSONとして解析を試みる
-                        try:
-                            # 単純な文字列の場合、JSON構造化レスポンスの可能性をチェック
-                            if message.strip().startswith('{') and message.strip().endswith('}'):
-                                potential_json = json.loads(message)
-                                
-                                # 構造化レスポンスのキーを持っているか確認
-                                if isinstance(potential_json, dict) and "agents" in potential_json and "status" in potential_json:
-                                    logger.info("テキストレスポンス内に構造化JSONを検出")
-                                    # 構造化レスポンスとして処理
-                                    formatted_response = format_structured_response(potential_json)
-                                    response_container.markdown(formatted_response)
-                                    display_content = formatted_response
-                                    
-                                    # デバッグ情報を展開可能セクションに表示
-                                    with response_container.expander("🔍 詳細情報"):
-                                        st.json(potential_json)
-                                else:
-                                    # 通常のテキストとして表示
-                                    response_container.markdown(message)
-                                    display_content = message
-                            else:
-                                # 通常のテキストとして表示
-                                response_container.markdown(message)
-                                display_content = message
-                        except (json.JSONDecodeError, Exception) as e:
-                            # JSON解析に失敗した場合は通常のテキストとして表示
-                            response_container.markdown(message)
-                            display_content = message
+                        response_container.markdown(message)
+                        display_content = message
                     
                     else:
                         response_container.warning("不明なレスポンスタイプ")
@@ -487,10 +831,7 @@ def render_chat_interface():
                     
                     # アシスタントメッセージを履歴に追加
                     if display_content:
-                        st.session_state.messages.append({
-                            "role": "assistant",
-                            "content": display_content
-                        })
+                        new_entries.append(("assistant", display_content))
                     
             except Exception as e:
                 error_msg = f"❌ エラーが発生しました: {str(e)}"
@@ -498,10 +839,10 @@ def render_chat_interface():
                 logger.error(f"実行エラー: {e}")
                 
                 # エラーメッセージも履歴に追加
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": error_msg
-                })
+                new_entries.append(("assistant", error_msg))
+            finally:
+                # 途中で再実行に割り込まれてもユーザーメッセージは残す
+                add_messages(*new_entries)
 
 
 def main():